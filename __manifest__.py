@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     'name': 'Extractos Bancarios',
-    'version': '17.0.1.0.0',
+    'version': '17.0.1.1.0',
     'category': 'Finance',
     'summary': 'Gestión de extractos bancarios e importación de pagos',
     'description': """
@@ -26,10 +26,14 @@
     ],
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_cron_data.xml',
+        'data/ir_config_parameter_data.xml',
         'views/tipo_extracto_views.xml',
         'views/cartera_views.xml',
         'views/extracto_views.xml',
         'views/extracto_linea_views.xml',
+        'wizard/importacion_lote_views.xml',
+        'wizard/previsualizacion_views.xml',
         'views/menu_views.xml',
     ],
     'installable': True,
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo import api, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Calcula la huella de las líneas ya importadas para la detección de duplicados.
+
+    Se usan los mismos datos que al importar, incluido el importe con signo leído del
+    archivo. Las líneas descartadas guardan el importe en valor absoluto, así que se
+    toman como cargos (importe negativo) salvo las que tienen préstamo: esas se
+    importaron como ingresos pendientes y se descartaron después a mano.
+    """
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    Linea = env['extractos.extracto_linea']
+    cr.execute("""
+        SELECT id, cartera_id, fecha,
+               CASE WHEN state = 'discarded' AND prestamo_id IS NULL THEN -importe ELSE importe END,
+               concepto, observaciones
+          FROM extractos_extracto_linea
+         WHERE huella IS NULL
+      ORDER BY id
+    """)
+    ocurrencias = {}
+    valores = []
+    for linea_id, cartera_id, fecha, importe, concepto, observaciones in cr.fetchall():
+        huella_base = Linea._calcular_huella(cartera_id, fecha, importe, concepto, observaciones)
+        ocurrencia = ocurrencias.get(huella_base, 0)
+        ocurrencias[huella_base] = ocurrencia + 1
+        huella = huella_base
+        if ocurrencia:
+            huella = Linea._calcular_huella(cartera_id, fecha, importe, concepto, observaciones, ocurrencia)
+        valores.append((huella, linea_id))
+    if valores:
+        cr.executemany("UPDATE extractos_extracto_linea SET huella = %s WHERE id = %s", valores)
+    _logger.info('Calculada la huella de %s líneas de extracto', len(valores))
@@ -5,4 +5,6 @@ from . import cartera
 from . import extracto
 from . import extracto_linea
 from . import extracto_linea_distribucion
+from . import distribucion_conceptos
+from . import res_partner
 
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api, _
+import json
 
 
 class ExtractosCartera(models.Model):
@@ -28,6 +29,26 @@ class ExtractosCartera(models.Model):
     
     active = fields.Boolean(string='Activo', default=True)
     
+    # Marca de agua de importación: los extractos acumulados solapan con los anteriores
+    importacion_incremental = fields.Boolean(
+        string='Importación Incremental',
+        default=False,
+        help='Omite las filas anteriores a la última fecha importada sin normalizarlas ni buscar duplicados. '
+             'Solo para carteras cuyos extractos se importan en orden cronológico'
+    )
+    marca_agua_fecha = fields.Date(
+        string='Última Fecha Importada',
+        readonly=True,
+        copy=False,
+        help='Fecha contable del último movimiento importado en esta cartera'
+    )
+    marca_agua_huellas = fields.Text(
+        string='Huellas de la Última Fecha',
+        readonly=True,
+        copy=False,
+        help='Huellas (JSON) de los movimientos ya importados con la última fecha'
+    )
+    
     @api.model_create_multi
     def create(self, vals_list):
         """Asegura que el nombre se establezca durante la creación"""
@@ -51,8 +72,42 @@ class ExtractosCartera(models.Model):
     
     @api.depends('extracto_ids')
     def _compute_extracto_count(self):
+        """Cuenta los extractos de todas las carteras con una única consulta agregada"""
+        conteos = {}
+        if self.ids:
+            conteos = {
+                cartera.id: count for cartera, count in self.env['extractos.extracto']._read_group(
+                    [('cartera_id', 'in', self.ids)], ['cartera_id'], ['__count']
+                )
+            }
         for record in self:
-            record.extracto_count = len(record.extracto_ids)
+            record.extracto_count = conteos.get(record._origin.id, 0)
+    
+    def _fecha_minima_importacion(self):
+        """Fecha a partir de la cual hay que leer los extractos de la cartera (False si se leen completos)"""
+        self.ensure_one()
+        return self.importacion_incremental and self.marca_agua_fecha
+    
+    def _huellas_marca_agua(self):
+        """Huellas ya importadas en la fecha de la marca de agua"""
+        self.ensure_one()
+        return set(json.loads(self.marca_agua_huellas or '[]'))
+    
+    def _avanzar_marca_agua(self, fecha, huellas):
+        """Avanza la marca de agua a la fecha dada con las huellas importadas en esa fecha"""
+        self.ensure_one()
+        if not fecha or (self.marca_agua_fecha and fecha < self.marca_agua_fecha):
+            return
+        if fecha == self.marca_agua_fecha:
+            huellas = set(huellas) | self._huellas_marca_agua()
+        self.sudo().write({
+            'marca_agua_fecha': fecha,
+            'marca_agua_huellas': json.dumps(sorted(huellas)),
+        })
+    
+    def action_reiniciar_marca_agua(self):
+        """Olvida la marca de agua para que el próximo extracto se lea completo"""
+        self.write({'marca_agua_fecha': False, 'marca_agua_huellas': False})
     
     def action_view_extractos(self):
         """Abre la vista de extractos de esta cartera"""
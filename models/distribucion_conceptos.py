@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api
+from odoo.tools import frozendict, ormcache
+
+# Tipo de linx.distribucion_pago de cada concepto de distribución (el resto son 'otros')
+TIPOS_DISTRIBUCION = {
+    'Capital': 'capital',
+    'Interés': 'interes',
+    'Mora': 'mora',
+    'Penalización': 'penalizacion',
+}
+
+
+class LinxImportPagosDistribucionConceptos(models.Model):
+    _inherit = 'linx.import.pagos.distribucion.conceptos'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Invalida la caché de conceptos"""
+        records = super().create(vals_list)
+        if records:
+            self.env.registry.clear_cache()
+        return records
+
+    def write(self, vals):
+        """Invalida la caché de conceptos solo si cambia de verdad algún nombre o su archivo"""
+        campos = [campo for campo in ('name', 'active') if campo in vals]
+        antes = [tuple(concepto[campo] for campo in campos) for concepto in self] if campos else []
+        res = super().write(vals)
+        if campos and antes != [tuple(concepto[campo] for campo in campos) for concepto in self]:
+            self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        """Invalida la caché de conceptos"""
+        borrados = bool(self)
+        res = super().unlink()
+        if borrados:
+            self.env.registry.clear_cache()
+        return res
+
+    @api.model
+    @ormcache()
+    def _nombres_conceptos(self):
+        """Nombre de cada concepto por id, compartido por todos los usuarios del worker.
+
+        Se invalida al crear, renombrar o eliminar conceptos (no debe modificarse).
+        """
+        return frozendict({
+            concepto['id']: concepto['name']
+            for concepto in self.sudo().search_read([], ['name'], order='id')
+        })
+
+    @api.model
+    @ormcache()
+    def _ids_por_nombre(self):
+        """Id de cada concepto por nombre (el primero si hay nombres repetidos)"""
+        ids_por_nombre = {}
+        for concepto_id, nombre in self._nombres_conceptos().items():
+            ids_por_nombre.setdefault(nombre, concepto_id)
+        return frozendict(ids_por_nombre)
+
+    @api.model
+    def _ids_conceptos(self, nombres, crear=True):
+        """Ids de los conceptos por nombre, creando en bloque los que no existan.
+
+        Los nombres vacíos (p. ej. de un concepto archivado, que no está en la caché)
+        quedan en False, y un concepto archivado se reutiliza en lugar de crear otro con
+        el mismo nombre. Con ``crear=False`` no se escribe nada y los que no existen
+        quedan en False.
+        """
+        ids_por_nombre = self._ids_por_nombre()
+        if not crear:
+            return {nombre: ids_por_nombre.get(nombre, False) for nombre in nombres}
+        faltan = [nombre for nombre in dict.fromkeys(nombres) if nombre and nombre not in ids_por_nombre]
+        if faltan:
+            ids_por_nombre = dict(ids_por_nombre)
+            for concepto in self.with_context(active_test=False).search_read(
+                [('name', 'in', faltan)], ['name'], order='id'
+            ):
+                ids_por_nombre.setdefault(concepto['name'], concepto['id'])
+            nuevos = [nombre for nombre in faltan if nombre not in ids_por_nombre]
+            if nuevos:
+                for concepto in self.create([{'name': nombre} for nombre in nuevos]):
+                    ids_por_nombre[concepto.name] = concepto.id
+        return {nombre: ids_por_nombre.get(nombre, False) for nombre in nombres}
+
+    @api.model
+    def _tipo_distribucion(self, concepto_id):
+        """Tipo de linx.distribucion_pago que corresponde al concepto"""
+        return TIPOS_DISTRIBUCION.get(self._nombres_conceptos().get(concepto_id), 'otros')
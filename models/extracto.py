@@ -2,13 +2,16 @@
 
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError, ValidationError
+from markupsafe import Markup
 import base64
-import io
+import contextlib
 import logging
 import json
+import mmap
+import os
 import re
-import pandas as pd
-from datetime import datetime
+
+from ..tools import lectores, parametros
 
 _logger = logging.getLogger(__name__)
 
@@ -43,37 +46,35 @@ class ExtractosExtracto(models.Model):
     
     file = fields.Binary(string='Archivo', required=True, attachment=True)
     file_name = fields.Char(string='Nombre del Archivo')
+    hoja = fields.Integer(
+        string='Hoja',
+        default=0,
+        readonly=True,
+        copy=False,
+        help='Posición de la hoja del libro XLS/XLSX que se importa (0 es la primera)'
+    )
     
     # Líneas del extracto
     linea_ids = fields.One2many('extractos.extracto_linea', 'extracto_id', string='Líneas')
     
-    # Campos Many2many computed para filtrar por estado (workaround para el bug de domain en One2many)
-    lineas_pendientes = fields.Many2many(
+    # Líneas por estado: el dominio se aplica en la consulta y el cliente solo lee la página visible
+    lineas_pendientes = fields.One2many(
         'extractos.extracto_linea',
-        'extracto_linea_pendiente_rel',
         'extracto_id',
-        'linea_id',
         string='Líneas Pendientes',
-        compute='_compute_lineas_by_state',
-        store=False
+        domain=[('state', '=', 'pending')]
     )
-    lineas_descartadas = fields.Many2many(
+    lineas_descartadas = fields.One2many(
         'extractos.extracto_linea',
-        'extracto_linea_descartada_rel',
         'extracto_id',
-        'linea_id',
         string='Líneas Descartadas',
-        compute='_compute_lineas_by_state',
-        store=False
+        domain=[('state', '=', 'discarded')]
     )
-    lineas_procesadas = fields.Many2many(
+    lineas_procesadas = fields.One2many(
         'extractos.extracto_linea',
-        'extracto_linea_procesada_rel',
         'extracto_id',
-        'linea_id',
         string='Líneas Procesadas',
-        compute='_compute_lineas_by_state',
-        store=False
+        domain=[('state', '=', 'processed')]
     )
     
     count_lineas_pendientes = fields.Integer(
@@ -100,63 +101,98 @@ class ExtractosExtracto(models.Model):
     
     state = fields.Selection([
         ('draft', 'Borrador'),
+        ('importing', 'Importando'),
         ('imported', 'Importado'),
         ('processed', 'Procesado')
     ], string='Estado', default='draft', tracking=True)
     
-    @api.depends('linea_ids', 'linea_ids.state')
-    def _compute_lineas_by_state(self):
-        """Calcula las líneas filtradas por estado usando Many2many computed"""
-        for record in self:
-            record.lineas_pendientes = record.linea_ids.filtered(lambda l: l.state == 'pending')
-            record.lineas_descartadas = record.linea_ids.filtered(lambda l: l.state == 'discarded')
-            record.lineas_procesadas = record.linea_ids.filtered(lambda l: l.state == 'processed')
+    # Progreso de la importación (en segundo plano se confirma tras cada bloque)
+    usuario_importacion_id = fields.Many2one('res.users', string='Importado por', readonly=True, copy=False)
+    filas_leidas = fields.Integer(string='Filas Leídas', readonly=True, copy=False)
+    lineas_creadas = fields.Integer(string='Líneas Creadas', readonly=True, copy=False)
+    lineas_asignadas = fields.Integer(string='Líneas Auto-Asignadas', readonly=True, copy=False)
+    filas_omitidas = fields.Integer(
+        string='Filas Omitidas',
+        readonly=True,
+        copy=False,
+        help='Filas anteriores a la marca de agua de la cartera, ya importadas en extractos previos'
+    )
     
-    @api.depends('linea_ids', 'linea_ids.state', 'linea_ids.prestamo_id')
+    # Procesado de las líneas revisadas en segundo plano
+    procesado_en_cola = fields.Boolean(string='Procesado en Cola', readonly=True, copy=False)
+    usuario_procesado_id = fields.Many2one('res.users', string='Procesado por', readonly=True, copy=False)
+    lineas_en_cola = fields.Integer(string='Líneas en Cola', readonly=True, copy=False)
+    lineas_procesadas_en_cola = fields.Integer(string='Líneas Procesadas en Cola', readonly=True, copy=False)
+    errores_en_cola = fields.Integer(string='Errores en Cola', readonly=True, copy=False)
+    
+    @api.depends('linea_ids.state')
     def _compute_lineas_count(self):
+        """Cuenta las líneas por estado con una única consulta agregada"""
+        conteos = {}
+        if self.ids:
+            for extracto, state, count in self.env['extractos.extracto_linea']._read_group(
+                [('extracto_id', 'in', self.ids)], ['extracto_id', 'state'], ['__count']
+            ):
+                conteos[(extracto.id, state)] = count
         for record in self:
-            record.count_lineas_pendientes = len(record.linea_ids.filtered(lambda l: l.state == 'pending'))
-            record.count_lineas_descartadas = len(record.linea_ids.filtered(lambda l: l.state == 'discarded'))
-            record.count_lineas_procesadas = len(record.linea_ids.filtered(lambda l: l.state == 'processed'))
+            record.count_lineas_pendientes = conteos.get((record._origin.id, 'pending'), 0)
+            record.count_lineas_descartadas = conteos.get((record._origin.id, 'discarded'), 0)
+            record.count_lineas_procesadas = conteos.get((record._origin.id, 'processed'), 0)
     
-    @api.depends('linea_ids', 'linea_ids.state', 'linea_ids.prestamo_id')
+    @api.depends('linea_ids.state', 'linea_ids.prestamo_id')
     def _compute_tiene_lineas_pendientes_sin_prestamo(self):
+        """Busca en una única consulta los extractos con líneas pendientes sin préstamo"""
+        Linea = self.env['extractos.extracto_linea']
+        con_pendientes = set()
+        if self.ids:
+            con_pendientes = {
+                extracto.id for [extracto] in Linea._read_group(
+                    Linea._dominio_pendientes_sin_prestamo(self.ids), ['extracto_id'],
+                )
+            }
         for record in self:
-            record.tiene_lineas_pendientes_sin_prestamo = bool(
-                record.linea_ids.filtered(lambda l: l.state == 'pending' and not l.prestamo_id)
-            )
+            record.tiene_lineas_pendientes_sin_prestamo = record._origin.id in con_pendientes
     
     def _fix_xlsx_empty_styles(self, file_data):
-        """Arregla estilos vacíos en archivos xlsx"""
-        try:
-            import zipfile
-            zin = zipfile.ZipFile(io.BytesIO(file_data), "r")
-            zout_buffer = io.BytesIO()
-            zout = zipfile.ZipFile(zout_buffer, "w", zipfile.ZIP_DEFLATED)
-            
-            for item in zin.infolist():
-                buffer = zin.read(item.filename)
-                if item.filename == "xl/styles.xml":
-                    buffer = buffer.decode("utf-8").replace("<fill/>", "").encode("utf-8")
-                zout.writestr(item, buffer)
-            zout.close()
-            zin.close()
-            return zout_buffer.getvalue()
-        except Exception:
-            return file_data
-    
-    def _parse_usecols(self, usecols_str):
-        """Convierte 'C:M' a formato pandas usecols"""
-        if not usecols_str:
-            return None
-        try:
-            # Convertir 'C:M' a ['C', 'D', ..., 'M']
-            start, end = usecols_str.strip().upper().split(':')
-            start_col = ord(start) - ord('A')
-            end_col = ord(end) - ord('A')
-            return list(range(start_col, end_col + 1))
-        except Exception:
-            return None
+        """Arregla estilos vacíos en archivos xlsx (ver ``lectores.reparar_estilos_xlsx``)"""
+        return lectores.reparar_estilos_xlsx(file_data)
+    
+    @contextlib.contextmanager
+    def _abrir_archivo(self):
+        """Abre el archivo del extracto en el filestore, proyectado en memoria y de solo lectura.
+        
+        Evita decodificar el base64 del campo y copiar el contenido; si el adjunto está
+        guardado en la base de datos se usa su contenido.
+        """
+        self.ensure_one()
+        attachment = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'file'),
+            ('res_id', '=', self.id),
+        ], limit=1)
+        archivo = None
+        if attachment.store_fname:
+            try:
+                archivo = open(attachment._full_path(attachment.store_fname), 'rb')
+            except OSError:
+                _logger.warning("No se puede abrir el archivo %s del filestore", attachment.store_fname, exc_info=True)
+        if archivo is None or not os.fstat(archivo.fileno()).st_size:
+            if archivo is not None:
+                archivo.close()
+            yield attachment.raw or base64.b64decode(self.file or b'')
+            return
+        with archivo:
+            data = lectores.ArchivoProyectado(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield data
+            finally:
+                lectores.cerrar_proyeccion(data)
+    
+    def _leer_bloques(self, data, tipo_extracto):
+        """Genera los DataFrames a importar con el lector registrado para el formato"""
+        if not lectores.soporta(tipo_extracto.formato):
+            raise UserError(_('Formato %s no soportado aún.') % tipo_extracto.formato)
+        return lectores.leer(data, dict(tipo_extracto._plan_extraccion(), hoja=self.hoja))
     
     def action_importar(self):
         """Importa el archivo según la configuración del tipo de extracto"""
@@ -166,346 +202,356 @@ class ExtractosExtracto(models.Model):
         if not self.cartera_id or not self.cartera_id.tipo_extracto_id:
             raise UserError(_('Debe seleccionar una cartera con tipo de extracto configurado.'))
         
-        tipo_extracto = self.cartera_id.tipo_extracto_id
-        
-        # Leer archivo
-        data = base64.b64decode(self.file)
+        if self.cartera_id.tipo_extracto_id.importacion_en_segundo_plano:
+            return self._encolar_importacion()
         
-        # Limpiar xlsx si es necesario
-        if tipo_extracto.formato in ['xlsx']:
-            data = self._fix_xlsx_empty_styles(data)
+        self._importar()
+        return True
+    
+    def action_previsualizar(self):
+        """Abre la previsualización de las primeras filas del archivo sin importarlo"""
+        self.ensure_one()
+        if not self.file:
+            raise UserError(_('No se ha seleccionado ningún archivo.'))
+        if not self.cartera_id or not self.cartera_id.tipo_extracto_id:
+            raise UserError(_('Debe seleccionar una cartera con tipo de extracto configurado.'))
+        return {
+            'name': _('Previsualizar Importación'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'extractos.previsualizacion',
+            'view_mode': 'form',
+            'target': 'new',
+            'context': {'default_extracto_id': self.id},
+        }
+    
+    def action_procesar_revisadas(self):
+        """Procesa todas las líneas pendientes revisadas y con préstamo"""
+        self.ensure_one()
+        lineas = self._lineas_revisadas()
+        if not lineas:
+            raise UserError(_('No hay líneas pendientes revisadas con préstamo.'))
         
-        try:
-            # Leer según formato
-            if tipo_extracto.formato in ['xls']:
-                engine = 'xlrd'
-                import xlrd
-                book = xlrd.open_workbook(file_contents=data)
-                _logger.info(f"The number of worksheets is {book.nsheets}")
-                # workbook = book.sheet_by_index(0)
-                sheet = book.sheet_by_index(0)
-                
-                start_lines = tipo_extracto.skiprows
-                data_list = []
-                if tipo_extracto.first_row_headers:
-                    l_headers = start_lines
-                    start_lines = start_lines + 1
-                else:
-                    l_headers = tipo_extracto.skiprows
-                    start_lines = tipo_extracto.skiprows + 1
-                
-                headers = sheet.row_values(l_headers) # Fila 16 (índice 15) son los headers
-                _logger.info(headers)
-                
-                for row_idx in range(start_lines, sheet.nrows):
-                    row_values = sheet.row_values(row_idx)
-                    row_dict = {}
-                    for col_idx, header in enumerate(headers):
-                        if col_idx < len(row_values):
-                            row_dict[header] = row_values[col_idx]
-                    data_list.append(row_dict)
-                df = pd.DataFrame(data_list)
-            elif tipo_extracto.formato in ['xlsx']:
-                engine = 'openpyxl' if tipo_extracto.formato == 'xlsx' else 'xlrd'
-                usecols = self._parse_usecols(tipo_extracto.usecols)
-                
-                read_params = {
-                    'io': io.BytesIO(data),
-                    'engine': engine,
-                    'skiprows': tipo_extracto.skiprows,
-                    'keep_default_na': False,
-                }
-                
-                if tipo_extracto.first_row_headers:
-                    read_params['header'] = 0
-                else:
-                    read_params['header'] = None
-                
-                if usecols:
-                    read_params['usecols'] = usecols
-                
-                df = pd.read_excel(**read_params)
-                
-            elif tipo_extracto.formato == 'csv':
-                read_params = {
-                    'filepath_or_buffer': io.BytesIO(data),
-                    'skiprows': tipo_extracto.skiprows,
-                    'keep_default_na': False,
-                }
-                if tipo_extracto.first_row_headers:
-                    read_params['header'] = 0
-                else:
-                    read_params['header'] = None
-                
-                df = pd.read_csv(**read_params)
-                
-            elif tipo_extracto.formato == 'txt':
-                # Leer como CSV con delimitador tab
-                read_params = {
-                    'filepath_or_buffer': io.BytesIO(data),
-                    'skiprows': tipo_extracto.skiprows,
-                    'sep': '\t',
-                    'keep_default_na': False,
-                }
-                if tipo_extracto.first_row_headers:
-                    read_params['header'] = 0
-                else:
-                    read_params['header'] = None
-                
-                df = pd.read_csv(**read_params)
-            else:
-                raise UserError(_('Formato %s no soportado aún.') % tipo_extracto.formato)
-            
-            # Preparar datos con información de columnas
-            tipo_extracto = self.tipo_extracto_id
-            _data = []
-            
-            # Si hay headers, obtener nombres de columnas; si no, usar índices
-            if tipo_extracto.first_row_headers:
-                columnas = list(df.columns)
-            else:
-                columnas = [str(i) for i in range(len(df.columns))]
-            
-            # Convertir cada fila a dict con información de columnas
-            for idx, row in df.iterrows():
-                item = {}
-                for i, col_name in enumerate(columnas):
-                    item[col_name] = row.iloc[i]
-                    # También añadir por índice numérico para facilitar búsqueda
-                    item[str(i)] = row.iloc[i]
-                _data.append(item)
-            
-            _logger.info('Importando %s líneas del extracto' % len(_data))
-            
-            # Obtener líneas existentes de esta cartera para evitar duplicados
-            existing_lines = self.env['extractos.extracto_linea'].search([
-                ('extracto_id.cartera_id', '=', self.cartera_id.id),
-                ('extracto_id', '!=', self.id)
-            ])
-            
-            # Crear líneas
-            nuevas_lineas = []
-            tipo_extracto = self.tipo_extracto_id
-            for item in _data:
-                # Intentar extraer campos usando las columnas configuradas
-                importe_raw = self._extract_importe(item, tipo_extracto)
-                fecha = self._extract_fecha(item, tipo_extracto)
-                concepto = self._extract_concepto(item, tipo_extracto)
-                observaciones = self._extract_observaciones(item, tipo_extracto)
-                
-                # Si no se pudo extraer el importe, descartar automáticamente
-                if importe_raw is None:
-                    state = 'discarded'
-                    importe_final = 0.0
-                # Si el importe es cero o negativo, descartar automáticamente (solo nos interesan ingresos positivos)
-                elif importe_raw <= 0:
-                    state = 'discarded'
-                    importe_final = abs(importe_raw) if importe_raw < 0 else 0.0
-                else:
-                    # Importe positivo: verificar si ya existe esta línea en otro extracto de la misma cartera
-                    if self._existe_linea_duplicada(existing_lines, concepto, observaciones, fecha, importe_raw):
-                        continue  # Saltar línea duplicada (no crear)
-                    state = 'pending'
-                    importe_final = importe_raw
-                
-                nuevas_lineas.append({
-                    'extracto_id': self.id,
-                    'fecha': fecha,
-                    'importe': importe_final,
-                    'concepto': concepto,
-                    'observaciones': observaciones,
-                    'state': state,
-                })
-            
-            # Crear líneas
-            if nuevas_lineas:
-                self.env['extractos.extracto_linea'].create(nuevas_lineas)
-                _logger.info('Creadas %s líneas nuevas' % len(nuevas_lineas))
-            
-            # Auto-asignar préstamos a líneas pendientes
-            count_lineas_pendientes = self.linea_ids.filtered(lambda l: l.state == 'pending')
-            for linea in count_lineas_pendientes:
-                linea.auto_asignar_prestamo()
-            
-            self.state = 'imported'
-            return True
+        ICP = self.env['ir.config_parameter'].sudo()
+        if len(lineas) > parametros.entero(ICP, 'extractos.procesado_en_segundo_plano', 500):
+            self.write({
+                'procesado_en_cola': True,
+                'usuario_procesado_id': self.env.user.id,
+                'lineas_en_cola': len(lineas),
+                'lineas_procesadas_en_cola': 0,
+                'errores_en_cola': 0,
+            })
+            self.env.ref('extractos.ir_cron_procesar_lineas')._trigger()
             return {
                 'type': 'ir.actions.client',
                 'tag': 'display_notification',
                 'params': {
-                    'title': _('Importación completada'),
-                    'message': _('Se importaron %s líneas. %s pendientes, %s descartadas.') % (
-                        len(nuevas_lineas),
-                        len(self.linea_ids.filtered(lambda l: l.state == 'pending')),
-                        len(self.linea_ids.filtered(lambda l: l.state == 'discarded'))
-                    ),
-                    'type': 'success',
+                    'title': _('Procesado en cola'),
+                    'message': _('Las %s líneas revisadas del extracto %s se procesarán en segundo plano.') % (len(lineas), self.name),
+                    'type': 'info',
                     'sticky': False,
+                    'next': {'type': 'ir.actions.client', 'tag': 'soft_reload'},
                 }
             }
-            
-        except Exception as e:
-            _logger.error("Error al importar extracto: %s", str(e), exc_info=True)
-            raise UserError(_('Error al importar el archivo: %s') % str(e))
-    
-    def _columna_a_indice(self, columna_letra):
-        """Convierte una letra de columna (A, B, C, etc.) a índice numérico (0, 1, 2, etc.)"""
-        if not columna_letra:
-            return None
-        columna_letra = columna_letra.strip().upper()
-        indice = 0
-        for char in columna_letra:
-            indice = indice * 26 + (ord(char) - ord('A') + 1)
-        return indice - 1
-    
-    def _obtener_valor_por_columna(self, item, columna_letra, fallback_keys=None):
-        """Obtiene el valor del item usando la columna configurada o busca por nombre de columna"""
-        # Si hay columna configurada, usarla
-        if columna_letra:
-            indice = self._columna_a_indice(columna_letra)
-            if indice is not None and isinstance(item, dict):
-                # Ahora cada item tiene tanto el índice numérico como el nombre de columna (si hay headers)
-                # Primero intentar con el índice numérico (siempre disponible)
-                if str(indice) in item:
-                    valor = item[str(indice)]
-                    if valor is not None and (not isinstance(valor, str) or valor.strip()):
-                        return valor
-                
-                # Si hay headers, también buscar por nombre de columna
-                # Las claves que no son numéricas son nombres de columnas
-                keys = [k for k in item.keys() if not (isinstance(k, str) and k.isdigit())]
-                if indice < len(keys):
-                    valor = item[keys[indice]]
-                    if valor is not None and (not isinstance(valor, str) or valor.strip()):
-                        return valor
         
-        # Fallback: buscar por nombres comunes si se proporcionan
-        if fallback_keys:
-            for key in fallback_keys:
-                if key in item and item[key] is not None:
-                    valor = item[key]
-                    if not isinstance(valor, str) or valor.strip():
-                        return valor
-        
-        return None
+        procesadas, errores = lineas._procesar_lineas()
+        return lineas._notificacion_procesado(procesadas, errores)
     
-    def _extract_importe(self, item, tipo_extracto=None):
-        """Extrae el importe del item usando la columna configurada"""
-        if not tipo_extracto:
-            tipo_extracto = self.tipo_extracto_id
-        
-        valor = self._obtener_valor_por_columna(
-            item, 
-            tipo_extracto.columna_importe if tipo_extracto else None,
-            fallback_keys=['IMPORTE', 'Importe', 'importe', 'IMPORT', 'Import', 'amount', 'Amount', 'AMOUNT']
-        )
+    def _lineas_revisadas(self):
+        """Líneas pendientes, revisadas y con préstamo del extracto"""
+        return self.env['extractos.extracto_linea'].search([
+            ('extracto_id', 'in', self.ids),
+            ('state', '=', 'pending'),
+            ('revisado', '=', True),
+            ('prestamo_id', '!=', False),
+        ], order='fecha, id')
+    
+    def _actualizar_estado_procesado(self):
+        """Marca como procesados los extractos importados que ya no tienen líneas pendientes"""
+        importados = self.filtered(lambda e: e.state == 'imported')
+        if not importados:
+            return
+        con_pendientes = {
+            extracto.id for [extracto] in self.env['extractos.extracto_linea']._read_group(
+                [('extracto_id', 'in', importados.ids), ('state', '=', 'pending')], ['extracto_id'],
+            )
+        }
+        importados.filtered(lambda e: e.id not in con_pendientes).write({'state': 'processed'})
+    
+    @api.model
+    def _cron_procesar_lineas(self):
+        """Procesa las líneas revisadas de los extractos en cola, confirmando tras cada lote.
         
-        if valor is not None:
+        Si el procesado falla, los lotes ya confirmados se conservan y el extracto sale
+        de la cola con el error publicado, para no reintentarlo en cada ejecución.
+        """
+        for extracto in self.search([('procesado_en_cola', '=', True)], order='write_date'):
+            extracto = extracto.with_user(extracto.usuario_procesado_id or self.env.user)
             try:
-                # Limpiar el valor si es string (quitar símbolos de moneda, espacios, etc.)
-                if isinstance(valor, str):
-                    # Preservar el signo negativo si existe
-                    valor_limpio = valor.replace('€', '').replace('$', '').replace(' ', '').strip()
-                    # Reemplazar coma por punto para decimales, pero preservar el signo
-                    if ',' in valor_limpio and '.' not in valor_limpio:
-                        valor_limpio = valor_limpio.replace(',', '.')
-                    val = float(valor_limpio)
-                    return val
-                else:
-                    val = float(valor)
-                    return val
-            except (ValueError, TypeError):
-                pass
-        return None  # Devolver None en lugar de 0.0 para distinguir entre "no encontrado" y "cero"
-    
-    def _extract_fecha(self, item, tipo_extracto=None):
-        """Extrae la fecha del item usando la columna configurada"""
-        if not tipo_extracto:
-            tipo_extracto = self.tipo_extracto_id
-        
-        valor = self._obtener_valor_por_columna(
-            item,
-            tipo_extracto.columna_fecha if tipo_extracto else None,
-            fallback_keys=['F. CONTABLE', 'FECHA', 'Fecha', 'fecha', 'FECHA CONTABLE', 'date', 'Date', 'DATE']
-        )
-        
-        if valor is not None:
+                _procesadas, errores = extracto._lineas_revisadas()._procesar_lineas(en_segundo_plano=True)
+            except Exception as e:
+                self.env.cr.rollback()
+                _logger.error("Error en el procesado en segundo plano del extracto %s", extracto.id, exc_info=True)
+                errores = [_('Error al procesar las líneas: %s') % str(e)]
+                extracto.errores_en_cola += 1
+            extracto.procesado_en_cola = False
+            if errores:
+                extracto.message_post(body=_('Errores al procesar las líneas:') + Markup('<br/>') + Markup('<br/>').join(errores))
+            partner = (extracto.usuario_procesado_id or self.env.user).partner_id
+            self.env['bus.bus']._sendone(partner, 'simple_notification', {
+                'title': _('Procesado completado'),
+                'message': _('%s: %s líneas procesadas, %s errores.') % (
+                    extracto.name, extracto.lineas_procesadas_en_cola, extracto.errores_en_cola
+                ),
+                'type': 'warning' if errores else 'success',
+                'sticky': False,
+            })
+            self.env.cr.commit()
+    
+    def _registrar_progreso_procesado(self, procesadas, errores):
+        """Guarda en el extracto cuántas líneas en cola se han procesado y cuántas han fallado"""
+        self.write({'lineas_procesadas_en_cola': procesadas, 'errores_en_cola': errores})
+    
+    def _encolar_importacion(self):
+        """Deja el extracto en cola para que lo importe la tarea programada"""
+        self._poner_en_cola()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Importación en cola'),
+                'message': _('El extracto %s se importará en segundo plano.') % self.name,
+                'type': 'info',
+                'sticky': False,
+                'next': {'type': 'ir.actions.client', 'tag': 'soft_reload'},
+            }
+        }
+    
+    def _poner_en_cola(self):
+        """Pone los extractos en estado de importación y avisa a la tarea programada"""
+        self.write({
+            'state': 'importing',
+            'usuario_importacion_id': self.env.user.id,
+            'filas_leidas': 0,
+            'lineas_creadas': 0,
+            'lineas_asignadas': 0,
+            'filas_omitidas': 0,
+        })
+        self.env.ref('extractos.ir_cron_importar_extractos')._trigger()
+    
+    @api.model
+    def _cron_importar_extractos(self):
+        """Importa los extractos en cola, confirmando la transacción tras cada bloque"""
+        for extracto in self.search([('state', '=', 'importing')], order='write_date'):
+            extracto = extracto.with_user(extracto.usuario_importacion_id or self.env.user)
             try:
-                # Si es un número (timestamp Excel), convertir
-                if isinstance(valor, (int, float)):
-                    return datetime.fromtimestamp((valor - 25569) * 86400).date()
-                # Si es string, intentar parsear
-                if isinstance(valor, str):
-                    for fmt in ['%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%Y/%m/%d', '%d/%m/%y']:
-                        try:
-                            return datetime.strptime(valor.strip(), fmt).date()
-                        except ValueError:
-                            continue
-            except Exception:
-                pass
-        return fields.Date.today()
-    
-    def _extract_concepto(self, item, tipo_extracto=None):
-        """Extrae el concepto del item usando la columna configurada"""
-        if not tipo_extracto:
-            tipo_extracto = self.tipo_extracto_id
-        
-        valor = self._obtener_valor_por_columna(
-            item,
-            tipo_extracto.columna_concepto if tipo_extracto else None,
-            fallback_keys=['CONCEPTO', 'Concepto', 'concepto', 'CONCEPT', 'Concept']
-        )
+                extracto._importar(en_segundo_plano=True)
+                extracto._notificar_progreso(_('Importación completada'), 'success')
+            except Exception as e:
+                self.env.cr.rollback()
+                _logger.error("Error en la importación en segundo plano del extracto %s", extracto.id, exc_info=True)
+                extracto.write({'state': 'draft'})
+                extracto.message_post(body=_('Error al importar el archivo: %s') % str(e))
+                extracto._notificar_progreso(_('Error al importar el archivo'), 'danger')
+            self.env.cr.commit()
+    
+    def _registrar_progreso(self, filas=0, creadas=0, asignadas=0, omitidas=0, en_segundo_plano=False):
+        """Acumula el progreso de la importación y, en segundo plano, lo confirma y notifica"""
+        self.write({
+            'filas_leidas': self.filas_leidas + filas,
+            'lineas_creadas': self.lineas_creadas + creadas,
+            'lineas_asignadas': self.lineas_asignadas + asignadas,
+            'filas_omitidas': self.filas_omitidas + omitidas,
+        })
+        if en_segundo_plano:
+            self.env.cr.commit()
+            self._notificar_progreso(_('Importando extracto'), 'info')
+    
+    def _notificar_progreso(self, titulo, tipo):
+        """Envía el progreso de la importación al usuario por el bus"""
+        partner = (self.usuario_importacion_id or self.env.user).partner_id
+        self.env['bus.bus']._sendone(partner, 'simple_notification', {
+            'title': titulo,
+            'message': _('%s: %s filas leídas, %s omitidas, %s líneas creadas, %s líneas auto-asignadas.') % (
+                self.name, self.filas_leidas, self.filas_omitidas, self.lineas_creadas, self.lineas_asignadas
+            ),
+            'type': tipo,
+            'sticky': False,
+        })
+    
+    def _importar(self, en_segundo_plano=False):
+        """Lee el archivo, crea las líneas y auto-asigna préstamos a las pendientes"""
+        self.ensure_one()
+        tipo_extracto = self.cartera_id.tipo_extracto_id
         
-        if valor is not None:
-            return str(valor)
-        return ''
-    
-    def _extract_ordenante(self, item, tipo_extracto=None):
-        """Extrae el ordenante/interviniente del item usando la columna configurada"""
-        if not tipo_extracto:
-            tipo_extracto = self.tipo_extracto_id
+        # Leer archivo directamente del filestore
+        with self._abrir_archivo() as data:
+            # Limpiar xlsx si es necesario
+            if tipo_extracto.formato in ['xlsx']:
+                data = self._fix_xlsx_empty_styles(data)
+            
+            try:
+                bloques = (
+                    self._normalizar_bloque(df, tipo_extracto)
+                    for df in self._leer_bloques(data, tipo_extracto)
+                )
+                self._importar_bloques(bloques, en_segundo_plano=en_segundo_plano)
+            except Exception as e:
+                _logger.error("Error al importar extracto: %s", str(e), exc_info=True)
+                raise UserError(_('Error al importar el archivo: %s') % str(e))
+    
+    def _importar_bloques(self, bloques, en_segundo_plano=False):
+        """Crea las líneas de los bloques normalizados y auto-asigna préstamos a las pendientes"""
+        self.ensure_one()
+        cartera = self.cartera_id
+        incremental = bool(cartera._fecha_minima_importacion())
+        huellas_marca_agua = cartera._huellas_marca_agua() if incremental else set()
+        marca_agua = {'fecha': cartera.marca_agua_fecha, 'huellas': set()}
         
-        valor = self._obtener_valor_por_columna(
-            item,
-            tipo_extracto.columna_ordenante if tipo_extracto else None,
-            fallback_keys=['ORDENANTE', 'Ordenante', 'ordenante', 'INTERVINIENTE', 'Interviniente', 'interviniente']
-        )
+        # Crear las líneas bloque a bloque
+        tamano_bloque = max(self.tipo_extracto_id.tamano_bloque, 1)
+        ocurrencias = {}
+        for datos in self._trocear_bloques(bloques, tamano_bloque):
+            omitidas = datos.attrs.get('filas_omitidas', 0)
+            filas = len(datos) + omitidas
+            _logger.info('Importando %s líneas del extracto' % filas)
+            nuevas_lineas = self._preparar_lineas(datos, ocurrencias)
+            fechas_leidas = datos['fecha_leida'].tolist()
+            del datos
+            self._actualizar_marca_agua(marca_agua, nuevas_lineas, fechas_leidas)
+            
+            # Las filas de la fecha de la marca de agua ya importadas se omiten sin consultar
+            if huellas_marca_agua:
+                total = len(nuevas_lineas)
+                nuevas_lineas = [vals for vals in nuevas_lineas if vals['huella'] not in huellas_marca_agua]
+                omitidas += total - len(nuevas_lineas)
+            
+            # Saltar líneas duplicadas (una única consulta por bloque)
+            huellas_existentes = self._huellas_existentes([vals['huella'] for vals in nuevas_lineas])
+            nuevas_lineas = [vals for vals in nuevas_lineas if vals['huella'] not in huellas_existentes]
+            
+            # Crear líneas
+            if nuevas_lineas:
+                self.env['extractos.extracto_linea'].create(nuevas_lineas)
+                _logger.info('Creadas %s líneas nuevas' % len(nuevas_lineas))
+            self._registrar_progreso(
+                filas=filas,
+                creadas=len(nuevas_lineas),
+                omitidas=omitidas,
+                en_segundo_plano=en_segundo_plano
+            )
         
-        if valor is not None:
-            return str(valor)
-        return ''
-    
-    def _extract_observaciones(self, item, tipo_extracto=None):
-        """Extrae las observaciones del item"""
-        # Las observaciones pueden venir de varias fuentes o combinarse con ordenante
-        ordenante = self._extract_ordenante(item, tipo_extracto) if tipo_extracto else None
+        # Auto-asignar préstamos a líneas pendientes
+        count_lineas_pendientes = self.linea_ids.filtered(lambda l: l.state == 'pending' and not l.prestamo_id)
+        for inicio in range(0, len(count_lineas_pendientes), tamano_bloque):
+            bloque = count_lineas_pendientes[inicio:inicio + tamano_bloque]
+            bloque.auto_asignar_prestamo()
+            self._registrar_progreso(
+                asignadas=len(bloque.filtered('prestamo_id')),
+                en_segundo_plano=en_segundo_plano
+            )
         
-        valor = self._obtener_valor_por_columna(
-            item,
-            None,  # No hay columna específica para observaciones
-            fallback_keys=['OBSERVACIONES', 'Observaciones', 'observaciones', 'OBS', 'Obs', 'DESCRIPCION', 'Descripcion', 'DETALLE', 'Detalle']
-        )
+        cartera._avanzar_marca_agua(marca_agua['fecha'], marca_agua['huellas'])
+        self.state = 'imported'
+    
+    @api.model
+    def _trocear_bloques(self, bloques, tamano_bloque):
+        """Divide los bloques normalizados en trozos de ``tamano_bloque`` filas como máximo.
         
-        observaciones = str(valor) if valor is not None else ''
+        CSV, TXT y los libros leídos sin bloques llegan en un único DataFrame: así las
+        líneas se crean y confirman por trozos en todos los formatos. Las filas omitidas
+        al normalizar se cuentan en el primer trozo.
+        """
+        for datos in bloques:
+            if len(datos) <= tamano_bloque:
+                yield datos
+                continue
+            omitidas = datos.attrs.get('filas_omitidas', 0)
+            for inicio in range(0, len(datos), tamano_bloque):
+                trozo = datos.iloc[inicio:inicio + tamano_bloque]
+                trozo.attrs = dict(datos.attrs, filas_omitidas=omitidas if not inicio else 0)
+                yield trozo
+    
+    def _actualizar_marca_agua(self, marca_agua, nuevas_lineas, fechas_leidas):
+        """Lleva en ``marca_agua`` la última fecha con movimientos y sus huellas.
         
-        # Si hay ordenante, añadirlo a las observaciones
-        if ordenante:
-            if observaciones:
-                observaciones = f"{observaciones} | Ordenante: {ordenante}"
-            else:
-                observaciones = f"Ordenante: {ordenante}"
+        Solo cuentan las filas cuya fecha se ha leído del archivo: las que llevan la
+        de hoy por no poder interpretarla (p. ej. una fila de totales) no la avanzan.
+        """
+        for vals, fecha_leida in zip(nuevas_lineas, fechas_leidas):
+            if not vals['huella'] or not fecha_leida:
+                continue
+            if not marca_agua['fecha'] or vals['fecha'] > marca_agua['fecha']:
+                marca_agua['fecha'] = vals['fecha']
+                marca_agua['huellas'] = set()
+            if vals['fecha'] == marca_agua['fecha']:
+                marca_agua['huellas'].add(vals['huella'])
+    
+    def _normalizar_bloque(self, df, tipo_extracto):
+        """Normaliza por columnas el DataFrame leído, aprendiendo el perfil de formato si hace falta"""
+        from ..tools import normalizacion  # Carga pandas solo al importar
+        plan = tipo_extracto._plan_extraccion()
+        if not plan['perfil']:
+            tipo_extracto._guardar_perfil(normalizacion.aprender_perfil(df, plan))
+            plan = tipo_extracto._plan_extraccion()
+        plan = dict(plan, fecha_minima=self.cartera_id._fecha_minima_importacion())
+        datos = normalizacion.normalizar(df, plan)
+        if datos.attrs['tasa_fallos'] > plan['umbral_reaprendizaje']:
+            # El formato del banco ha cambiado: las celdas ya se han interpretado con las reglas generales
+            _logger.info('Reaprendiendo el perfil de formato de %s (%.0f%% de fallos)',
+                         tipo_extracto.name, datos.attrs['tasa_fallos'] * 100)
+            tipo_extracto._guardar_perfil(normalizacion.aprender_perfil(df, plan))
+        return datos
+    
+    def _preparar_lineas(self, datos, ocurrencias):
+        """Devuelve los valores de las líneas a crear a partir de un bloque normalizado"""
+        # Solo nos interesan ingresos positivos: el resto se descarta automáticamente
+        importes = datos['importe']
+        pendientes = importes.gt(0)
+        importes_finales = importes.abs().where(importes.lt(0), importes.where(pendientes, 0.0))
         
-        return observaciones
-    
-    def _existe_linea_duplicada(self, existing_lines, concepto, observaciones, fecha, importe):
-        """Verifica si ya existe una línea similar en otro extracto de la misma cartera"""
-        for existing in existing_lines:
-            if (existing.concepto == concepto and 
-                existing.observaciones == observaciones and
-                existing.fecha == fecha and
-                abs(existing.importe - importe) < 0.01):
-                return True
-        return False
+        nuevas_lineas = []
+        for fecha, fecha_leida, importe, importe_leido, concepto, observaciones, pendiente in zip(
+            datos['fecha'], datos['fecha_leida'], importes_finales, importes,
+            datos['concepto'], datos['observaciones'], pendientes
+        ):
+            # La huella permite detectar si ya existe en otro extracto de la cartera; las descartadas
+            # también la llevan (con el importe con signo) para que un reintento no las duplique.
+            # Las filas sin fecha interpretable llevan la de hoy, que no entra en la huella para
+            # que el mismo archivo importado otro día dé la misma
+            huella = self._huella_linea(
+                ocurrencias, fecha if fecha_leida else False, importe_leido, concepto, observaciones
+            )
+            nuevas_lineas.append({
+                'extracto_id': self.id,
+                'fecha': fecha,
+                'importe': float(importe),
+                'concepto': concepto,
+                'observaciones': observaciones,
+                'state': 'pending' if pendiente else 'discarded',
+                'huella': huella,
+            })
+        return nuevas_lineas
+    
+    def _huella_linea(self, ocurrencias, fecha, importe, concepto, observaciones):
+        """Calcula la huella de una línea, numerando los movimientos idénticos del mismo fichero"""
+        Linea = self.env['extractos.extracto_linea']
+        huella_base = Linea._calcular_huella(self.cartera_id.id, fecha, importe, concepto, observaciones)
+        ocurrencia = ocurrencias.get(huella_base, 0)
+        ocurrencias[huella_base] = ocurrencia + 1
+        if not ocurrencia:
+            return huella_base
+        return Linea._calcular_huella(self.cartera_id.id, fecha, importe, concepto, observaciones, ocurrencia)
+    
+    def _huellas_existentes(self, huellas):
+        """Devuelve las huellas que ya existen en la cartera del extracto"""
+        huellas = [huella for huella in huellas if huella]
+        if not huellas:
+            return set()
+        lineas = self.env['extractos.extracto_linea'].search_read([
+            ('cartera_id', '=', self.cartera_id.id),
+            ('huella', 'in', huellas),
+        ], ['huella'])
+        return {linea['huella'] for linea in lineas}
     
     def action_usar_inteligencia_artificial(self):
         """Usa IA para asociar conceptos con operaciones basándose en nombres de intervinientes"""
@@ -650,7 +696,7 @@ class ExtractosExtracto(models.Model):
             lineas_dict = {linea.id: linea for linea in count_lineas_pendientes}
             prestamos_dict = {prestamo.id: prestamo for prestamo in prestamos}
             
-            asignadas = 0
+            asignadas = self.env['extractos.extracto_linea']
             errores = []
             
             for asociacion in asociaciones:
@@ -677,11 +723,12 @@ class ExtractosExtracto(models.Model):
                     'auto_asignado': True
                 })
                 
-                # Actualizar distribución automáticamente
-                linea.actualiza_lista_distribucion()
-                asignadas += 1
+                asignadas |= linea
+            
+            # Actualizar distribución automáticamente
+            asignadas.actualiza_lista_distribucion()
             
-            mensaje = _('Se asignaron %s líneas usando IA.') % asignadas
+            mensaje = _('Se asignaron %s líneas usando IA.') % len(asignadas)
             if errores:
                 mensaje += '\n\nErrores:\n' + '\n'.join(errores[:5])
             
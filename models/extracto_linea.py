@@ -1,13 +1,23 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
+from odoo import models, fields, api, Command, _
 from odoo.exceptions import UserError
+from odoo.osv import expression
+from odoo.tools import SQL, float_compare, sql
+import hashlib
 import logging
 import re
 from dateutil.relativedelta import relativedelta
 
+from ..tools import identidad, parametros, reparto
+
 _logger = logging.getLogger(__name__)
 
+# Cuotas que se añaden a la distribución con "Cargar más cuotas"
+CUOTAS_POR_PAGINA = 5
+# Clientes que se prueban por cada posible nombre de las observaciones
+CLIENTES_POR_NOMBRE = 5
+
 
 class ExtractosExtractoLinea(models.Model):
     _name = 'extractos.extracto_linea'
@@ -38,6 +48,12 @@ class ExtractosExtractoLinea(models.Model):
     currency_id = fields.Many2one('res.currency', default=lambda self: self.env.company.currency_id)
     concepto = fields.Char(string='Concepto')
     observaciones = fields.Text(string='Observaciones')
+    huella = fields.Char(
+        string='Huella',
+        copy=False,
+        readonly=True,
+        help='Identificador del movimiento usado para detectar duplicados entre extractos de la misma cartera'
+    )
     
     prestamo_id = fields.Many2one(
         'linx.prestamo',
@@ -77,6 +93,11 @@ class ExtractosExtractoLinea(models.Model):
         compute='_compute_importe_distribuido'
     )
     pago_parcial = fields.Boolean(string='Pago Parcial', default=False)
+    cuotas_extra = fields.Integer(
+        string='Cuotas Adicionales',
+        default=0,
+        help='Cuotas que se muestran en la distribución además de las que cubre el importe'
+    )
     
     pago_id = fields.Many2one('linx.pago', string='Pago Creado', readonly=True)
     
@@ -84,6 +105,57 @@ class ExtractosExtractoLinea(models.Model):
     importe_extraordinario = fields.Monetary(string='Importe Extraordinario', currency_field='currency_id')
     concepto_extraordinario = fields.Char(string='Concepto Extraordinario')
     
+    _sql_constraints = [
+        ('huella_cartera_uniq', 'unique(cartera_id, huella)',
+         'Este movimiento ya ha sido importado en otro extracto de la cartera.'),
+    ]
+    
+    def init(self):
+        """Índices de las consultas de asignación de préstamos y de las líneas por estado"""
+        # Pagos previos de la cartera con préstamo, por importe (_cargar_pagos_previos)
+        sql.create_index(
+            self.env.cr, 'extractos_extracto_linea_cartera_importe_asignada_idx', self._table,
+            ['cartera_id', 'importe'], where='prestamo_id IS NOT NULL'
+        )
+        # Líneas y recuentos por extracto y estado
+        sql.create_index(
+            self.env.cr, 'extractos_extracto_linea_extracto_state_idx', self._table,
+            ['extracto_id', 'state']
+        )
+    
+    @api.model
+    def _dominio_pagos_previos(self, cartera, importes):
+        """Dominio de las líneas ya asignadas de la cartera con alguno de los importes"""
+        return [
+            ('cartera_id', '=', cartera.id),
+            ('prestamo_id', '!=', False),
+            ('importe', 'in', list(importes)),
+        ]
+    
+    @api.model
+    def _dominio_pendientes_sin_prestamo(self, extracto_ids):
+        """Dominio de las líneas pendientes sin préstamo de los extractos"""
+        return [('extracto_id', 'in', list(extracto_ids)), ('state', '=', 'pending'), ('prestamo_id', '=', False)]
+    
+    @api.model
+    def _calcular_huella(self, cartera_id, fecha, importe, concepto, observaciones, ocurrencia=0):
+        """Calcula la huella de un movimiento (cartera, fecha, importe y textos normalizados).
+        
+        La ocurrencia distingue movimientos idénticos dentro del mismo fichero.
+        """
+        def normaliza(texto):
+            return ' '.join(str(texto or '').split()).upper()
+        
+        clave = '|'.join([
+            str(cartera_id or ''),
+            fields.Date.to_string(fecha) or '',
+            '%.2f' % (importe or 0.0),
+            normaliza(concepto),
+            normaliza(observaciones),
+            str(ocurrencia),
+        ])
+        return hashlib.sha1(clave.encode('utf-8')).hexdigest()
+    
     @api.depends('distribucion_ids', 'distribucion_ids.importe_pagado')
     def _compute_importe_distribuido(self):
         for record in self:
@@ -94,6 +166,13 @@ class ExtractosExtractoLinea(models.Model):
         self.actualiza_lista_distribucion()
         return self.open_action_distribucion()
     
+    def action_cargar_mas_cuotas(self):
+        """Añade más cuotas pendientes a la distribución, a la fecha de cálculo elegida en el diálogo"""
+        self.ensure_one()
+        self.cuotas_extra += CUOTAS_POR_PAGINA
+        self.actualiza_lista_distribucion(reiniciar_fecha=False)
+        return self.open_action_distribucion()
+    
     def action_marcar_revisado(self):
         """Marca/desmarca como revisado"""
         self.ensure_one()
@@ -106,13 +185,7 @@ class ExtractosExtractoLinea(models.Model):
             raise UserError(_('Debe indicar importe y concepto para el extraordinario.'))
         
         # Buscar o crear concepto
-        concepto = self.env['linx.import.pagos.distribucion.conceptos'].search([
-            ('name', '=', self.concepto_extraordinario)
-        ], limit=1)
-        if not concepto:
-            concepto = self.env['linx.import.pagos.distribucion.conceptos'].create({
-                'name': self.concepto_extraordinario
-            })
+        conceptos = self.env['linx.import.pagos.distribucion.conceptos']._ids_conceptos([self.concepto_extraordinario])
         
         # Obtener siguiente orden
         max_orden = max(self.distribucion_ids.mapped('orden')) if self.distribucion_ids else 0
@@ -122,7 +195,7 @@ class ExtractosExtractoLinea(models.Model):
             'orden': max_orden + 1,
             'fecha': self.fecha,
             'importe': self.importe_extraordinario,
-            'concepto_id': concepto.id,
+            'concepto_id': conceptos[self.concepto_extraordinario],
             'extraordinario': True,
             'enabled': True
         })
@@ -150,294 +223,566 @@ class ExtractosExtractoLinea(models.Model):
         }
     
     def auto_asignar_prestamo(self):
-        """Intenta asignar automáticamente un préstamo a esta línea"""
-        self.ensure_one()
-        if self.prestamo_id or not self.observaciones:
-            return
+        """Intenta asignar automáticamente un préstamo a las líneas sin préstamo"""
+        lineas = self.filtered(lambda l: not l.prestamo_id and l.observaciones and l.prestamista_id)
+        asignadas = self.env['extractos.extracto_linea']
+        for cartera in lineas.cartera_id:
+            lineas_cartera = lineas.filtered(lambda l: l.cartera_id == cartera)
+            prestamo_ids = self._buscar_prestamos(cartera, [
+                {'id': linea.id, 'observaciones': linea.observaciones, 'importe': linea.importe}
+                for linea in lineas_cartera
+            ])
+            por_prestamo = {}
+            for linea, prestamo_id in zip(lineas_cartera, prestamo_ids):
+                if prestamo_id:
+                    por_prestamo.setdefault(prestamo_id, []).append(linea.id)
+            for prestamo_id, linea_ids in por_prestamo.items():
+                lineas_prestamo = self.browse(linea_ids)
+                lineas_prestamo.write({'prestamo_id': prestamo_id, 'auto_asignado': True})
+                asignadas |= lineas_prestamo
+        asignadas.actualiza_lista_distribucion()
+    
+    @api.model
+    def _buscar_prestamos(self, cartera, movimientos):
+        """Busca el préstamo de cada movimiento con un número fijo de consultas.
+        
+        ``movimientos`` es una lista de diccionarios con id, observaciones e importe.
+        Devuelve la lista de ids de préstamo (o False) en el mismo orden. Se aplican,
+        por este orden, los mismos criterios que la asignación línea a línea:
         
-        prestamista_id = self.prestamista_id.id if self.prestamista_id else None
+        1. Pagos previos de la cartera con el mismo importe y observaciones similares
+        2. Número de préstamo en observaciones (ej: HIS 12345)
+        3. DNI/NIF en observaciones
+        4. Nombre del cliente en observaciones
+        """
+        prestamista_id = cartera.prestamista_id.id
+        resultado = [False] * len(movimientos)
         if not prestamista_id:
-            return
+            return resultado
         
-        # 1. Buscar por concepto/observaciones en pagos previos de la misma cartera
-        pagos_previos = self.env['extractos.extracto_linea'].search([
-            ('cartera_id', '=', self.cartera_id.id),
-            ('prestamo_id', '!=', False),
-            ('observaciones', 'ilike', self.observaciones),
-            ('importe', '=', self.importe),
-            ('id', '!=', self.id)
-        ], order='id desc', limit=1)
-        
-        if pagos_previos:
-            self.prestamo_id = pagos_previos.prestamo_id
-            self.auto_asignado = True
-            self.actualiza_lista_distribucion()
-            return
+        observaciones = [mov['observaciones'] or '' for mov in movimientos]
+        numeros_his = [self._extraer_numero_his(obs) for obs in observaciones]
+        dnis = [self._extraer_dni(obs) for obs in observaciones]
+        palabras = [self._extraer_nombres(obs) for obs in observaciones]
         
-        # 2. Buscar número de préstamo en observaciones (ej: HIS 12345)
-        match = re.search(r'HIS\s*(\d+)', self.observaciones or '', re.IGNORECASE)
-        if match:
-            op_number = match.group(1)
-            prestamo = self.env['linx.prestamo'].search([
-                ('name', 'ilike', f'HIS {op_number}'),
-                ('prestamista_id', '=', prestamista_id)
-            ], limit=1)
-            if prestamo:
-                self.prestamo_id = prestamo
-                self.auto_asignado = True
-                self.actualiza_lista_distribucion()
-                return
+        # Tablas de búsqueda cargadas una sola vez
+        pagos_previos = self._cargar_pagos_previos(cartera, {mov['importe'] for mov in movimientos})
+        prestamos_his = self._cargar_prestamos_his(prestamista_id, {num for num in numeros_his if num})
+        partners_dni = self._cargar_partners_dni({dni for dni in dnis if dni})
+        partners_nombre = self._cargar_partners_nombre({palabra for lista in palabras for palabra in lista})
+        partner_ids = {partner_id for ids in partners_dni.values() for partner_id in ids}
+        partner_ids |= {partner_id for ids in partners_nombre.values() for partner_id in ids}
+        prestamos_partner = self._cargar_prestamos_partner(prestamista_id, partner_ids)
         
-        # 3. Buscar por DNI/NIF en observaciones
-        match_dni = re.search(r'(\d{8}[A-Z]?)', self.observaciones or '')
-        if match_dni:
-            dni = match_dni.group(1)
-            # Buscar partner
-            partner = self.env['res.partner'].search([('vat', 'ilike', dni)], limit=1)
-            if partner:
-                # Buscar préstamo activo del partner con este prestamista
-                prestamo_partner = self.env['linx.prestamo_partner'].search([
-                    ('partner_id', '=', partner.id),
-                    ('prestamo_id.prestamista_id', '=', prestamista_id),
-                    ('prestamo_id.state', 'in', ['formalized', 'confirmed'])
-                ], limit=1)
-                if prestamo_partner:
-                    self.prestamo_id = prestamo_partner.prestamo_id
-                    self.auto_asignado = True
-                    self.actualiza_lista_distribucion()
-                    return
-        
-        # 4. Buscar por nombre en observaciones
-        # Extraer posibles nombres (palabras con mayúsculas)
-        palabras = re.findall(r'\b[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+\b', self.observaciones or '')
-        for palabra in palabras[:3]:  # Limitar a 3 palabras para no hacer demasiadas búsquedas
-            if len(palabra) > 3:
-                partner = self.env['res.partner'].search([
-                    ('name', 'ilike', palabra),
-                    ('category_id.name', '=', 'Cliente')
-                ], limit=5)
-                for p in partner:
-                    prestamo_partner = self.env['linx.prestamo_partner'].search([
-                        ('partner_id', '=', p.id),
-                        ('prestamo_id.prestamista_id', '=', prestamista_id),
-                        ('prestamo_id.state', 'in', ['formalized', 'confirmed'])
-                    ], limit=1)
-                    if prestamo_partner:
-                        self.prestamo_id = prestamo_partner.prestamo_id
-                        self.auto_asignado = True
-                        self.actualiza_lista_distribucion()
-                        return
-    
-    def actualiza_lista_distribucion(self):
-        """Actualiza la lista de distribución del pago (similar a ActualizaListaDistribucion de linx)"""
-        if "NewId" in str(self.id):
-            return
+        for index, mov in enumerate(movimientos):
+            if not observaciones[index]:
+                continue
+            texto = observaciones[index].lower()
+            importe = round(mov['importe'] or 0.0, 2)
+            prestamo_id = False
+            
+            # 1. Buscar por concepto/observaciones en pagos previos de la misma cartera
+            candidatos = [
+                (previo_id, previo_prestamo)
+                for previo_id, previo_obs, previo_prestamo in pagos_previos.get(importe, [])
+                if previo_id != mov['id'] and texto in previo_obs
+            ]
+            if candidatos:
+                prestamo_id = max(candidatos, key=lambda candidato: candidato[0] or 0)[1]
+            
+            # 2. Buscar número de préstamo en observaciones (ej: HIS 12345)
+            if not prestamo_id and numeros_his[index]:
+                patron = ('his %s' % numeros_his[index]).lower()
+                prestamo_id = next(
+                    (p_id for p_id, nombre in prestamos_his if patron in nombre), False
+                )
+            
+            # 3. Buscar por DNI/NIF en observaciones
+            if not prestamo_id and dnis[index]:
+                prestamo_id = next(
+                    (prestamos_partner[p_id] for p_id in partners_dni.get(dnis[index], []) if p_id in prestamos_partner),
+                    False
+                )
+            
+            # 4. Buscar por nombre en observaciones
+            for palabra in palabras[index]:
+                if prestamo_id:
+                    break
+                prestamo_id = next(
+                    (prestamos_partner[p_id] for p_id in partners_nombre.get(palabra, []) if p_id in prestamos_partner),
+                    False
+                )
+            
+            if prestamo_id:
+                resultado[index] = prestamo_id
+                # Las siguientes líneas también pueden coincidir con esta asignación
+                pagos_previos.setdefault(importe, []).append((mov['id'], texto, prestamo_id))
+        return resultado
+    
+    @api.model
+    def _extraer_numero_his(self, observaciones):
+        """Número de operación indicado en las observaciones (ej: HIS 12345)"""
+        match = re.search(r'HIS\s*(\d+)', observaciones or '', re.IGNORECASE)
+        return match.group(1) if match else False
+    
+    @api.model
+    def _extraer_dni(self, observaciones):
+        """DNI/NIE/CIF indicado en las observaciones, normalizado.
         
-        if not self.prestamo_id:
-            return
-        if not self.fecha:
+        El CIF se prueba antes que el DNI para no tomar sus cifras como un DNI.
+        """
+        match = re.search(
+            r'(\b[ABCDEFGHJNPQRSUVW]\d{7}[0-9A-J]\b|[XYZ]\d{7}[A-Z]?|\d{8}[A-Z]?|\b\d{7}[A-Z]\b)',
+            observaciones or ''
+        )
+        return identidad.normalizar_documento(match.group(1)) if match else False
+    
+    @api.model
+    def _extraer_nombres(self, observaciones):
+        """Posibles nombres (palabras con mayúsculas), limitados a 3 para no hacer demasiadas búsquedas"""
+        palabras = re.findall(r'\b[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+\b', observaciones or '')
+        return [palabra for palabra in palabras[:3] if len(palabra) > 3]
+    
+    @api.model
+    def _cargar_pagos_previos(self, cartera, importes):
+        """Líneas ya asignadas de la cartera, agrupadas por importe"""
+        pagos_previos = {}
+        if not importes:
+            return pagos_previos
+        for linea in self.search_read(
+            self._dominio_pagos_previos(cartera, importes), ['observaciones', 'importe', 'prestamo_id']
+        ):
+            pagos_previos.setdefault(round(linea['importe'], 2), []).append(
+                (linea['id'], (linea['observaciones'] or '').lower(), linea['prestamo_id'][0])
+            )
+        return pagos_previos
+    
+    @api.model
+    def _cargar_prestamos_his(self, prestamista_id, numeros):
+        """Préstamos del prestamista cuyo nombre contiene alguno de los números de operación"""
+        if not numeros:
+            return []
+        prestamos = self.env['linx.prestamo'].search_read(expression.AND([
+            [('prestamista_id', '=', prestamista_id)],
+            expression.OR([[('name', 'ilike', f'HIS {numero}')] for numero in numeros]),
+        ]), ['name'])
+        return [(prestamo['id'], (prestamo['name'] or '').lower()) for prestamo in prestamos]
+    
+    @api.model
+    def _cargar_partners_dni(self, dnis):
+        """Partners de cada DNI normalizado (todos si hay duplicados, por id), en una búsqueda por igualdad"""
+        partners_dni = {}
+        if not dnis:
+            return partners_dni
+        for partner in self.env['res.partner'].search_read(
+            [('extractos_nif_normalizado', 'in', list(dnis))], ['extractos_nif_normalizado'], order='id'
+        ):
+            partners_dni.setdefault(partner['extractos_nif_normalizado'], []).append(partner['id'])
+        return partners_dni
+    
+    @api.model
+    def _cargar_partners_nombre(self, palabras):
+        """Primeros clientes cuyo nombre contiene cada palabra ({palabra: [ids]}).
+        
+        Como en la búsqueda línea a línea, cada palabra trae como mucho
+        ``CLIENTES_POR_NOMBRE`` clientes (un apellido común no carga miles), pero todas
+        las palabras se buscan en una única consulta.
+        """
+        partners_nombre = {}
+        if not palabras:
+            return partners_nombre
+        Partner = self.env['res.partner']
+        consultas = []
+        for palabra in sorted(palabras):
+            query = Partner._search(
+                [('category_id.name', '=', 'Cliente'), ('name', 'ilike', palabra)],
+                limit=CLIENTES_POR_NOMBRE,
+                order=Partner._order,
+            )
+            consultas.append(SQL('(%s)', query.select(SQL('%s', palabra), SQL.identifier(query.table, 'id'))))
+        self.env.cr.execute(SQL(' UNION ALL ').join(consultas))
+        for palabra, partner_id in self.env.cr.fetchall():
+            partners_nombre.setdefault(palabra, []).append(partner_id)
+        return partners_nombre
+    
+    @api.model
+    def _cargar_prestamos_partner(self, prestamista_id, partner_ids):
+        """Primer préstamo activo con el prestamista de cada partner"""
+        prestamos_partner = {}
+        if not partner_ids:
+            return prestamos_partner
+        for prestamo_partner in self.env['linx.prestamo_partner'].search_read([
+            ('partner_id', 'in', list(partner_ids)),
+            ('prestamo_id.prestamista_id', '=', prestamista_id),
+            ('prestamo_id.state', 'in', ['formalized', 'confirmed'])
+        ], ['partner_id', 'prestamo_id']):
+            if prestamo_partner['prestamo_id']:
+                prestamos_partner.setdefault(prestamo_partner['partner_id'][0], prestamo_partner['prestamo_id'][0])
+        return prestamos_partner
+    
+    def actualiza_lista_distribucion(self, reiniciar_fecha=True):
+        """Actualiza la lista de distribución de los pagos (similar a ActualizaListaDistribucion de linx).
+        
+        Trabaja sobre todas las líneas a la vez: las cuotas de los préstamos y los
+        conceptos se leen de una sola vez y las filas nuevas se crean en bloque. Con
+        ``reiniciar_fecha=False`` se calcula a la fecha de cálculo de cada línea en
+        lugar de volver a su fecha.
+        """
+        lineas = self.filtered(lambda l: isinstance(l.id, int) and l.prestamo_id and l.fecha)
+        if not lineas:
             return
         
-        self.write({'fecha_calculo': self.fecha})
-        _logger.debug('ActualizaListaDistribucion %s' % self.prestamo_id.name)
+        lineas_por_fecha = {}
+        for linea in lineas:
+            if reiniciar_fecha or not linea.fecha_calculo:
+                lineas_por_fecha.setdefault(linea.fecha, []).append(linea.id)
+        for fecha, linea_ids in lineas_por_fecha.items():
+            self.browse(linea_ids).write({'fecha_calculo': fecha})
         
-        items = []
-        limit = 25
-        count = 0
+        # Precargar juntas las cuotas de todos los préstamos
+        lineas.prestamo_id.cuota_ids.mapped('realmente_pagada')
+        
+        conceptos = lineas._ids_conceptos_distribucion()
+        
+        # Las líneas de un mismo préstamo que se actualizan juntas comparten la
+        # instantánea de su deuda y, por orden de fecha, cada una solo ve lo que no
+        # han cubierto las anteriores aunque se calculen a fechas distintas
+        instantanea = {}
+        consumos = {}
+        crear, actualizar, eliminar = [], {}, []
+        for linea in lineas.sorted(key=lambda l: (l.fecha, l.id)):
+            consumido = consumos.setdefault(linea.prestamo_id.id, {})
+            _logger.debug('ActualizaListaDistribucion %s' % linea.prestamo_id.name)
+            items = linea._items_distribucion(linea.fecha_calculo, consumido, instantanea)
+            filas = linea._filas_distribucion(items, conceptos)
+            linea_crear, linea_actualizar, linea_eliminar = linea._reconciliar_distribucion(filas)
+            crear += linea_crear
+            for cambios, ids in linea_actualizar.items():
+                actualizar.setdefault(cambios, []).extend(ids)
+            eliminar += linea_eliminar
+            linea._consumir_deuda(filas, consumido)
+        
+        # Solo se tocan las filas que cambian, en bloque
+        Distribucion = self.env['extractos.extracto_linea_distribucion']
+        if eliminar:
+            Distribucion.browse(eliminar).unlink()
+        for cambios, ids in actualizar.items():
+            Distribucion.browse(ids).write(dict(cambios))
+        if crear:
+            Distribucion.create(crear)
+        
+        # Distribuir el importe
+        lineas.distribuye()
+    
+    def _ids_conceptos_distribucion(self, crear=True):
+        """Ids de los conceptos de los items de deuda y de los extraordinarios de las líneas.
+        
+        Con ``crear=False`` (previsualización) no se crean los que falten: quedan en False
+        y sus items no se muestran hasta actualizar la distribución.
+        """
+        extraordinarias = self.distribucion_ids.filtered(lambda x: x.extraordinario == True)
+        Conceptos = self.env['linx.import.pagos.distribucion.conceptos']
+        nombres_conceptos = Conceptos._nombres_conceptos()
+        return Conceptos._ids_conceptos(
+            ['Penalización', 'Mora', 'Interés', 'Capital']
+            + [nombres_conceptos.get(item.concepto_id.id, '') for item in extraordinarias],
+            crear=crear,
+        )
+    
+    @api.model
+    def _interes_ajustado(self, cuota):
+        """Interés de la cuota ajustando el céntimo de descuadre entre su importe y capital más interés"""
+        interes = cuota.interes
+        if cuota.importe != cuota.capital + interes:
+            diff = cuota.importe - (cuota.capital + interes)
+            if diff > 0 and diff < 0.02:
+                interes += diff
+            elif diff < 0 and diff > -0.02:
+                interes -= diff
+        return interes
+    
+    @api.model
+    def _ajustar_centimos(self, cuotas):
+        """Guarda en las cuotas el ajuste del céntimo con el que se ha calculado la distribución"""
+        for cuota in cuotas:
+            interes = self._interes_ajustado(cuota)
+            if interes != cuota.interes:
+                cuota.interes = interes
+    
+    @api.model
+    def _cuotas_pendientes(self, prestamo_id, instantanea):
+        """Cuotas no pagadas del préstamo, por número.
         
-        cuotas_no_pagadas = self.prestamo_id.cuota_ids.filtered(
+        Devuelve una tupla de (cuota, fecha de la cuota, interés, capital) pendientes. El
+        interés incluye el ajuste del céntimo, que solo se guarda al procesar. Se guarda en
+        ``instantanea`` por préstamo para el resto de líneas del mismo cálculo.
+        """
+        clave = ('cuotas', prestamo_id)
+        if clave in instantanea:
+            return instantanea[clave]
+        prestamo = self.env['linx.prestamo'].browse(prestamo_id)
+        cuotas = prestamo.cuota_ids.filtered(
             lambda x: x.realmente_pagada == False
         ).sorted(key=lambda x: x.numero)
+        instantanea[clave] = tuple(
+            (
+                cuota.id,
+                cuota.fecha,
+                self._interes_ajustado(cuota) - cuota.interes_pagado,
+                cuota.capital - cuota.capital_pagado,
+            )
+            for cuota in cuotas
+        )
+        return instantanea[clave]
+    
+    @api.model
+    def _recargos_cuota(self, cuota_id, fecha, instantanea):
+        """Penalización y mora pendientes de la cuota a la fecha de cálculo, guardadas en ``instantanea``"""
+        clave = ('recargos', cuota_id, fecha)
+        if clave not in instantanea:
+            cuota = self.env['linx.cuota'].browse(cuota_id)
+            instantanea[clave] = (
+                cuota.penalizacion_a_fecha(fecha) - cuota.penalizacion_pagada,
+                cuota.get_mora_a_fecha(fecha) - cuota.mora_pagada,
+            )
+        return instantanea[clave]
+    
+    def _items_distribucion(self, fecha, consumido, instantanea):
+        """Importes pendientes (penalización, mora, interés y capital) de las cuotas que cubre el pago.
         
-        for cuota in cuotas_no_pagadas:
-            # Ajustar centimo de la cuota si es necesario
-            if cuota.importe != cuota.capital + cuota.interes:
-                diff = cuota.importe - (cuota.capital + cuota.interes)
-                if diff > 0 and diff < 0.02:
-                    cuota.interes += diff
-                elif diff < 0 and diff > -0.02:
-                    cuota.interes -= diff
-            
-            # Penalización
-            penalizacion_a_fecha = cuota.penalizacion_a_fecha(self.fecha_calculo)
-            penalizacion_pendiente = penalizacion_a_fecha - cuota.penalizacion_pagada
-            if penalizacion_pendiente >= 0.02:
-                items.append({
-                    'importe': penalizacion_pendiente,
-                    'fecha': cuota.fecha,
-                    'concepto': 'Penalización',
-                    'cuota': cuota.id
-                })
-            
-            # Mora
-            mora_pendiente = cuota.get_mora_a_fecha(self.fecha_calculo) - cuota.mora_pagada
-            if mora_pendiente >= 0.02:
-                items.append({
-                    'importe': mora_pendiente,
-                    'fecha': cuota.fecha,
-                    'concepto': 'Mora',
-                    'cuota': cuota.id
-                })
-            
-            # Interés
-            interes_pendiente = cuota.interes - cuota.interes_pagado
-            if interes_pendiente >= 0.02:
-                items.append({
-                    'importe': interes_pendiente,
-                    'fecha': cuota.fecha,
-                    'concepto': 'Interés',
-                    'cuota': cuota.id
-                })
-            
-            # Capital
-            capital_pendiente = cuota.capital - cuota.capital_pagado
-            if capital_pendiente >= 0.02:
-                items.append({
-                    'importe': capital_pendiente,
-                    'fecha': cuota.fecha,
-                    'concepto': 'Capital',
-                    'cuota': cuota.id
-                })
-            
-            count += 1
-            if count >= limit:
-                break
-        
-        # Obtener distribución actual
-        cache = {}
-        index = 0
-        current_dist = self.distribucion_ids.sorted(
-            key=lambda x: (-int(x.extraordinario), x.orden)
+        Las cuotas se recorren por orden hasta que lo pendiente cubre el importe de la línea,
+        más las cuotas adicionales configuradas y las cargadas a mano en la línea; la
+        penalización y la mora solo se calculan para esas cuotas. ``consumido`` indica,
+        por (cuota, concepto), lo ya asignado por otras líneas, e ``instantanea`` guarda la
+        deuda leída para las siguientes líneas del mismo cálculo.
+        """
+        self.ensure_one()
+        ICP = self.env['ir.config_parameter'].sudo()
+        adicionales = parametros.entero(ICP, 'extractos.cuotas_adicionales', 1) + self.cuotas_extra
+        
+        items = []
+        acumulado = 0
+        for cuota_id, fecha_cuota, interes, capital in self._cuotas_pendientes(self.prestamo_id.id, instantanea):
+            if acumulado >= self.importe:
+                if adicionales <= 0:
+                    break
+                adicionales -= 1
+            penalizacion, mora = self._recargos_cuota(cuota_id, fecha, instantanea)
+            for concepto, pendiente in (
+                ('Penalización', penalizacion),
+                ('Mora', mora),
+                ('Interés', interes),
+                ('Capital', capital),
+            ):
+                pendiente -= consumido.get((cuota_id, concepto), 0)
+                if pendiente >= 0.02:
+                    items.append({
+                        'importe': pendiente,
+                        'fecha': fecha_cuota,
+                        'concepto': concepto,
+                        'cuota': cuota_id
+                    })
+                    # Lo que no se va a cobrar no cubre el importe
+                    if (concepto == 'Mora' and not self.aplicar_moras) or \
+                            (concepto == 'Penalización' and not self.aplicar_penalizaciones):
+                        continue
+                    acumulado += pendiente
+        return items
+    
+    def _consumir_deuda(self, filas, consumido):
+        """Anota en ``consumido`` lo que el reparto de la línea asigna a cada cuota y concepto"""
+        self.ensure_one()
+        nombres_conceptos = self.env['linx.import.pagos.distribucion.conceptos']._nombres_conceptos()
+        pagos, _pago_parcial, _importe_distribuido = reparto.calcular_reparto(
+            self.importe,
+            [{
+                'importe': fila['importe'],
+                'enabled': fila['enabled'],
+                'concepto': nombres_conceptos.get(fila['concepto_id']),
+            } for _clave, fila in filas],
+            aplicar_moras=self.aplicar_moras,
+            aplicar_penalizaciones=self.aplicar_penalizaciones,
+            pago_parcial=self.pago_parcial,
         )
+        for (_clave, fila), (importe_pagado, _pagado_parcial) in zip(filas, pagos):
+            if fila.get('cuota_id') and importe_pagado:
+                clave = (fila['cuota_id'], nombres_conceptos.get(fila['concepto_id']))
+                consumido[clave] = consumido.get(clave, 0) + importe_pagado
+    
+    def _filas_distribucion(self, items, conceptos):
+        """Valores de las filas de distribución: primero los extraordinarios y después los items.
+        
+        Devuelve una lista de (clave, valores); la clave identifica la fila existente que
+        corresponde a cada una (ver ``_clave_distribucion``). Se omiten los items cuyo
+        concepto no existe aún (solo ocurre al previsualizar, que no los crea).
+        """
+        self.ensure_one()
+        nombres_conceptos = self.env['linx.import.pagos.distribucion.conceptos']._nombres_conceptos()
+        filas = []
         
         # Procesar extraordinarios primero
-        extraordinarias = self.distribucion_ids.filtered(lambda x: x.extraordinario == True)
-        for item in extraordinarias:
-            concepto_name = item.concepto_id.name if item.concepto_id else ''
-            if concepto_name in cache:
-                concepto = cache[concepto_name]
-            else:
-                concepto = self.env['linx.import.pagos.distribucion.conceptos'].search([
-                    ('name', '=', concepto_name)
-                ], limit=1)
-                if not concepto:
-                    concepto = self.env['linx.import.pagos.distribucion.conceptos'].create({
-                        'name': concepto_name
-                    })
-                cache[concepto_name] = concepto
-            
-            if current_dist and index < len(current_dist):
-                current_dist[index].write({
-                    'orden': index + 1,
-                    'fecha': item.fecha,
-                    'importe': item.importe,
-                    'extraordinario': True,
-                    'concepto_id': concepto.id,
-                    'enabled': True
-                })
-            else:
-                self.env['extractos.extracto_linea_distribucion'].create({
-                    'orden': index + 1,
-                    'fecha': item.fecha,
-                    'linea_id': self.id,
-                    'importe': item.importe,
-                    'extraordinario': True,
-                    'concepto_id': concepto.id,
-                    'enabled': True
-                })
-            index += 1
+        for item in self.distribucion_ids.filtered(lambda x: x.extraordinario == True):
+            # Un concepto archivado no tiene nombre en la caché: el extraordinario conserva el suyo
+            filas.append((self._clave_distribucion(item), {
+                'fecha': item.fecha,
+                'importe': item.importe,
+                'extraordinario': True,
+                'concepto_id': conceptos.get(nombres_conceptos.get(item.concepto_id.id)) or item.concepto_id.id,
+                'enabled': True
+            }))
         
         # Procesar items normales
         for item in items:
-            concepto_name = item['concepto']
-            if concepto_name in cache:
-                concepto = cache[concepto_name]
-            else:
-                concepto = self.env['linx.import.pagos.distribucion.conceptos'].search([
-                    ('name', '=', concepto_name)
-                ], limit=1)
-                if not concepto:
-                    concepto = self.env['linx.import.pagos.distribucion.conceptos'].create({
-                        'name': concepto_name
-                    })
-                cache[concepto_name] = concepto
-            
-            if current_dist and index < len(current_dist):
-                current_dist[index].write({
-                    'orden': index + 1,
-                    'fecha': item['fecha'],
-                    'importe': item['importe'],
-                    'concepto_id': concepto.id,
-                    'cuota_id': item['cuota'],
-                    'enabled': True,
-                    'extraordinario': False
-                })
+            if not conceptos[item['concepto']]:
+                continue
+            filas.append(((item['cuota'], conceptos[item['concepto']], False), {
+                'fecha': item['fecha'],
+                'importe': item['importe'],
+                'concepto_id': conceptos[item['concepto']],
+                'cuota_id': item['cuota'],
+                'enabled': True,
+                'extraordinario': False
+            }))
+        
+        for index, (_clave, vals) in enumerate(filas):
+            vals['orden'] = index + 1
+        return filas
+    
+    @api.model
+    def _clave_distribucion(self, fila):
+        """Clave de una fila de distribución: (cuota, concepto, extraordinario), y su id si es extraordinaria"""
+        if fila.extraordinario:
+            return ('extraordinario', fila.id)
+        return (fila.cuota_id.id, fila.concepto_id.id, False)
+    
+    def _reconciliar_distribucion(self, filas):
+        """Compara las filas calculadas con las existentes por su clave.
+        
+        Devuelve los valores de las filas a crear, los cambios a escribir agrupados
+        ({cambios: ids}) y los ids de las filas que sobran.
+        """
+        self.ensure_one()
+        existentes = {}
+        eliminar = []
+        for fila in self.distribucion_ids:
+            clave = self._clave_distribucion(fila)
+            if clave in existentes:
+                eliminar.append(fila.id)
             else:
-                self.env['extractos.extracto_linea_distribucion'].create({
-                    'orden': index + 1,
-                    'fecha': item['fecha'],
-                    'linea_id': self.id,
-                    'importe': item['importe'],
-                    'concepto_id': concepto.id,
-                    'cuota_id': item['cuota'],
-                    'enabled': True,
-                    'extraordinario': False
-                })
-            index += 1
+                existentes[clave] = fila
         
-        # Distribuir el importe
-        self.distribuye()
+        crear = []
+        actualizar = {}
+        for clave, vals in filas:
+            fila = existentes.pop(clave, None)
+            if fila is None:
+                crear.append(dict(vals, linea_id=self.id))
+                continue
+            cambios = {
+                campo: valor for campo, valor in vals.items()
+                if not self._mismo_valor(fila, campo, valor)
+            }
+            if cambios:
+                actualizar.setdefault(tuple(sorted(cambios.items())), []).append(fila.id)
+        eliminar += [fila.id for fila in existentes.values()]
+        return crear, actualizar, eliminar
+    
+    @api.model
+    def _mismo_valor(self, fila, campo, valor):
+        """Indica si el campo de la fila ya tiene el valor dado"""
+        actual = fila[campo]
+        if isinstance(actual, models.BaseModel):
+            return actual.id == (valor or False)
+        if isinstance(actual, float):
+            return float_compare(actual, valor or 0.0, precision_digits=2) == 0
+        return actual == valor
     
     def distribuye(self):
-        """Distribuye el importe entre las líneas de distribución"""
-        _logger.debug('Distribuyendo %s' % self.prestamo_id.name if self.prestamo_id else 'Sin préstamo')
-        self.ensure_one()
-        if not self.distribucion_ids:
-            return
+        """Distribuye el importe entre las líneas de distribución.
         
-        importe = self.importe
-        importe_distribuido = 0
+        El reparto de todas las líneas se calcula en memoria y se guarda con una
+        escritura por cada combinación de valores, tanto en las filas como en las
+        líneas, sin importar cuántas haya.
+        """
+        Distribucion = self.env['extractos.extracto_linea_distribucion']
+        filas_por_valores = {}
+        lineas_por_valores = {}
+        for linea in self:
+            _logger.debug('Distribuyendo %s' % linea.prestamo_id.name if linea.prestamo_id else 'Sin préstamo')
+            if not linea.distribucion_ids:
+                continue
+            lista, pagos, pago_parcial, _importe_distribuido = linea._calcular_reparto()
+            
+            # Agrupar las filas que cambian por valores a escribir
+            for item, (importe_pagado, pagado_parcial) in zip(lista, pagos):
+                if item.importe_pagado != importe_pagado or item.pagado_parcial != pagado_parcial:
+                    filas_por_valores.setdefault((importe_pagado, pagado_parcial), []).append(item.id)
+            lineas_por_valores.setdefault(pago_parcial, []).append(linea.id)
+        
+        for (importe_pagado, pagado_parcial), ids in filas_por_valores.items():
+            Distribucion.browse(ids).write({'importe_pagado': importe_pagado, 'pagado_parcial': pagado_parcial})
+        # importe_distribuido se calcula de las filas: no hace falta escribirlo
+        for pago_parcial, ids in lineas_por_valores.items():
+            self.browse(ids).write({'pago_parcial': pago_parcial, 'revisado': not pago_parcial})
+    
+    def _calcular_reparto(self):
+        """Reparto del importe entre las filas de distribución actuales, sin escribir nada.
         
+        Devuelve las filas ordenadas, el (importe_pagado, pagado_parcial) de cada una,
+        el indicador de pago parcial y el importe distribuido.
+        """
+        self.ensure_one()
+        nombres_conceptos = self.env['linx.import.pagos.distribucion.conceptos']._nombres_conceptos()
         lista = self.distribucion_ids.sorted(
             key=lambda x: (-int(x.extraordinario), x.orden)
         )
+        pagos, pago_parcial, importe_distribuido = reparto.calcular_reparto(
+            self.importe,
+            [{
+                'importe': item.importe,
+                'enabled': item.enabled,
+                'concepto': nombres_conceptos.get(item.concepto_id.id),
+            } for item in lista],
+            aplicar_moras=self.aplicar_moras,
+            aplicar_penalizaciones=self.aplicar_penalizaciones,
+            pago_parcial=self.pago_parcial,
+        )
+        return lista, pagos, pago_parcial, importe_distribuido
+    
+    def _previsualizar_distribucion(self):
+        """Calcula en el formulario la lista de distribución a la fecha de cálculo, sin escribir nada.
         
-        for item in lista:
-            if importe < 0.01:
-                item.write({'importe_pagado': 0, 'pagado_parcial': False})
-                continue
-            if item.enabled == False:
-                item.write({'importe_pagado': 0, 'pagado_parcial': False})
-                continue
-            if self.aplicar_moras == False and item.concepto_id.name == 'Mora':
-                item.write({'importe_pagado': 0, 'pagado_parcial': False})
-                continue
-            if self.aplicar_penalizaciones == False and item.concepto_id.name == 'Penalización':
-                item.write({'importe_pagado': 0, 'pagado_parcial': False})
-                continue
-            
-            diff = round(item.importe, 2) - round(importe, 2)
-            if diff > 0.01:
-                # Pago parcial
-                item.write({'importe_pagado': importe, 'pagado_parcial': True})
-                importe_distribuido += importe
-                importe = 0
-                self.write({'pago_parcial': True})
-            elif diff < 0.01:
-                # Pago completo y sobra
-                item.write({'importe_pagado': item.importe, 'pagado_parcial': False})
-                importe_distribuido += item.importe
-                self.write({'pago_parcial': False})
-                importe -= item.importe
-            else:
-                # Pago completo exacto
-                item.write({'importe_pagado': item.importe, 'pagado_parcial': False})
-                importe_distribuido += item.importe
-                self.write({'pago_parcial': False})
-                importe = 0
+        Si las filas cambian, el reparto lo calcula ``_onchange_distribucion_ids``, que el
+        formulario ejecuta a continuación; solo se calcula aquí si no cambian (o si el
+        formulario no encadena los onchange): así se calcula una sola vez.
+        """
+        self.ensure_one()
+        # Los conceptos que falten se crean al guardar la distribución, no en la previsualización
+        conceptos = self._ids_conceptos_distribucion(crear=False)
+        # Igual que al actualizar la línea sola: sin otras líneas que consuman su deuda
+        items = self._items_distribucion(self.fecha_calculo or self.fecha, {}, {})
+        filas = self._filas_distribucion(items, conceptos)
         
-        self.write({'importe_distribuido': importe_distribuido})
-        self.revisado = not self.pago_parcial
+        crear, actualizar, eliminar = self._reconciliar_distribucion(filas)
+        comandos = [Command.delete(fila_id) for fila_id in eliminar]
+        for cambios, ids in actualizar.items():
+            comandos += [Command.update(fila_id, dict(cambios)) for fila_id in ids]
+        comandos += [Command.create(vals) for vals in crear]
+        if comandos:
+            self.distribucion_ids = comandos
+            if self.env.context.get('recursive_onchanges', True):
+                return
+        self._previsualizar_reparto()
+    
+    def _previsualizar_reparto(self):
+        """Calcula en el formulario el reparto del importe, sin escribir nada"""
+        self.ensure_one()
+        if not self.distribucion_ids:
+            return
+        lista, pagos, pago_parcial, _importe_distribuido = self._calcular_reparto()
+        for item, (importe_pagado, pagado_parcial) in zip(lista, pagos):
+            item.update({'importe_pagado': importe_pagado, 'pagado_parcial': pagado_parcial})
+        self.update({'pago_parcial': pago_parcial, 'revisado': not pago_parcial})
     
     def action_descartar(self):
         """Descarta esta línea"""
@@ -448,77 +793,150 @@ class ExtractosExtractoLinea(models.Model):
         """Restaura una línea descartada"""
         self.ensure_one()
         self.write({'state': 'pending'})
+        # El extracto vuelve a tener líneas pendientes
+        self.extracto_id.filtered(lambda e: e.state == 'processed').write({'state': 'imported'})
     
     def action_procesar(self):
-        """Procesa la línea creando el pago en linx"""
-        self.ensure_one()
-        if not self.prestamo_id:
-            raise UserError(_('Debe asignar un préstamo antes de procesar.'))
-        if self.state == 'processed':
-            raise UserError(_('Esta línea ya ha sido procesada.'))
-        
-        # Crear linx.pago
-        pago_vals = {
-            'prestamo_id': self.prestamo_id.id,
-            'fecha': self.fecha_calculo or self.fecha,
-            'importe': self.importe,
-            'comentarios': self.observaciones or self.concepto or '',
-            'currency_id': self.currency_id.id,
-        }
-        pago = self.env['linx.pago'].create(pago_vals)
-        self.pago_id = pago
-        
-        # Crear linx.distribucion_pago
-        for dist in self.distribucion_ids.filtered(lambda d: d.importe_pagado > 0):
-            tipo = 'otros'
-            concepto_name = dist.concepto_id.name if dist.concepto_id else ''
-            if concepto_name == 'Capital':
-                tipo = 'capital'
-            elif concepto_name == 'Interés':
-                tipo = 'interes'
-            elif concepto_name == 'Mora':
-                tipo = 'mora'
-            elif concepto_name == 'Penalización':
-                tipo = 'penalizacion'
-            
-            self.env['linx.distribucion_pago'].create({
-                'pago_id': pago.id,
-                'prestamo_id': self.prestamo_id.id,
-                'cuota_id': dist.cuota_id.id if dist.cuota_id else False,
-                'importe': dist.importe_pagado,
-                'tipo': tipo,
-                'concepto_id': dist.concepto_id.id if dist.concepto_id else False,
-                'fecha': self.fecha_calculo or self.fecha,
-                'fecha_cuota': dist.cuota_id.fecha if dist.cuota_id else False,
-            })
-        
-        self.write({'state': 'processed'})
+        """Procesa las líneas creando sus pagos en linx (solo las pendientes, revisadas y con préstamo)"""
+        procesadas, errores = self._procesar_lineas()
+        if len(self) == 1:
+            if errores:
+                raise UserError(errores[0])
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('Línea procesada'),
+                    'message': _('Se ha creado el pago %s para el préstamo %s') % (self.pago_id.name, self.prestamo_id.name),
+                    'type': 'success',
+                    'sticky': False,
+                }
+            }
+        return self._notificacion_procesado(procesadas, errores)
+    
+    @api.model
+    def _notificacion_procesado(self, procesadas, errores):
+        """Notificación con el resultado de procesar varias líneas"""
+        titulo = _('Se han procesado %s líneas') % len(procesadas)
+        if errores:
+            titulo = _('Se han procesado %s líneas con %s errores') % (len(procesadas), len(errores))
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
-                'title': _('Línea procesada'),
-                'message': _('Se ha creado el pago %s para el préstamo %s') % (pago.name, self.prestamo_id.name),
-                'type': 'success',
-                'sticky': False,
+                'title': titulo,
+                'message': '\n'.join(errores),
+                'type': 'warning' if errores else 'success',
+                'sticky': bool(errores),
+                'next': {'type': 'ir.actions.client', 'tag': 'soft_reload'},
             }
         }
     
+    def _procesar_lineas(self, en_segundo_plano=False):
+        """Procesa las líneas por lotes y devuelve las procesadas y los errores.
+        
+        Cada lote se crea en bloque; si falla, se repite línea a línea con un savepoint
+        por línea para que una línea errónea no deshaga el resto. En segundo plano se
+        confirma la transacción tras cada lote.
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        tamano_lote = parametros.entero(ICP, 'extractos.lote_procesado', 200, minimo=1)
+        
+        errores = []
+        for linea in self:
+            if linea.state == 'processed':
+                errores.append(_('%s: Esta línea ya ha sido procesada.') % linea.display_name)
+            elif linea.state != 'pending':
+                errores.append(_('%s: Solo se procesan líneas pendientes.') % linea.display_name)
+            elif not linea.prestamo_id:
+                errores.append(_('%s: Debe asignar un préstamo antes de procesar.') % linea.display_name)
+            elif not linea.revisado:
+                errores.append(_('%s: La línea no está revisada.') % linea.display_name)
+        
+        # Mismo criterio que Extracto._lineas_revisadas
+        procesadas = self.browse()
+        pendientes = self.filtered(lambda l: l.state == 'pending' and l.prestamo_id and l.revisado)
+        for inicio in range(0, len(pendientes), tamano_lote):
+            lote = pendientes[inicio:inicio + tamano_lote]
+            try:
+                with self.env.cr.savepoint():
+                    lote._crear_pagos()
+                procesadas |= lote
+            except Exception:
+                for linea in lote:
+                    try:
+                        with self.env.cr.savepoint():
+                            linea._crear_pagos()
+                        procesadas |= linea
+                    except Exception as e:
+                        _logger.error("Error al procesar la línea %s: %s", linea.id, str(e), exc_info=True)
+                        errores.append('%s: %s' % (linea.display_name, str(e)))
+            if en_segundo_plano:
+                self.extracto_id._registrar_progreso_procesado(len(procesadas), len(errores))
+                self.env.cr.commit()
+        procesadas.extracto_id._actualizar_estado_procesado()
+        return procesadas, errores
+    
+    def _crear_pagos(self):
+        """Crea en bloque los linx.pago de las líneas y su distribución"""
+        if not self:
+            return
+        # Guardar el ajuste del céntimo con el que se calculó la distribución
+        self._ajustar_centimos(self.distribucion_ids.cuota_id)
+        
+        # Crear linx.pago
+        pagos = self.env['linx.pago'].create([{
+            'prestamo_id': linea.prestamo_id.id,
+            'fecha': linea.fecha_calculo or linea.fecha,
+            'importe': linea.importe,
+            'comentarios': linea.observaciones or linea.concepto or '',
+            'currency_id': linea.currency_id.id,
+        } for linea in self])
+        
+        # Crear linx.distribucion_pago
+        Conceptos = self.env['linx.import.pagos.distribucion.conceptos']
+        distribuciones = []
+        for linea, pago in zip(self, pagos):
+            linea.pago_id = pago
+            for dist in linea.distribucion_ids.filtered(lambda d: d.importe_pagado > 0):
+                distribuciones.append({
+                    'pago_id': pago.id,
+                    'prestamo_id': linea.prestamo_id.id,
+                    'cuota_id': dist.cuota_id.id if dist.cuota_id else False,
+                    'importe': dist.importe_pagado,
+                    'tipo': Conceptos._tipo_distribucion(dist.concepto_id.id),
+                    'concepto_id': dist.concepto_id.id if dist.concepto_id else False,
+                    'fecha': linea.fecha_calculo or linea.fecha,
+                    'fecha_cuota': dist.cuota_id.fecha if dist.cuota_id else False,
+                })
+        if distribuciones:
+            self.env['linx.distribucion_pago'].create(distribuciones)
+        
+        self.write({'state': 'processed'})
+    
     @api.onchange('prestamo_id')
     def _onchange_prestamo_id(self):
-        """Cuando se asigna un préstamo, actualizar distribución"""
-        if self.prestamo_id:
-            self.actualiza_lista_distribucion()
+        """Cuando se asigna un préstamo, previsualizar la distribución a la fecha de la línea.
+        
+        Si la fecha de cálculo cambia, la previsualización la hace ``_onchange_fecha_calculo``,
+        que se ejecuta a continuación: así se calcula una sola vez.
+        """
+        if self.prestamo_id and self.fecha:
+            self.cuotas_extra = 0
+            if self.fecha_calculo != self.fecha:
+                self.fecha_calculo = self.fecha
+            else:
+                self._previsualizar_distribucion()
     
     @api.onchange('fecha_calculo')
     def _onchange_fecha_calculo(self):
-        """Cuando cambia la fecha de cálculo, actualizar distribución"""
-        if self.prestamo_id:
-            self.actualiza_lista_distribucion()
+        """Cuando cambia la fecha de cálculo, previsualizar la distribución"""
+        if self.prestamo_id and self.fecha:
+            self._previsualizar_distribucion()
     
     @api.onchange('distribucion_ids')
     def _onchange_distribucion_ids(self):
-        """Cuando cambia la distribución, redistribuir"""
+        """Cuando cambia la distribución (a mano o al previsualizarla), previsualizar el reparto"""
         if self.distribucion_ids:
-            self.distribuye()
+            self._previsualizar_reparto()
 
@@ -12,6 +12,7 @@ class ExtractosExtractoLineaDistribucion(models.Model):
         'extractos.extracto_linea',
         string='Línea de Extracto',
         required=True,
+        index=True,
         ondelete='cascade'
     )
     
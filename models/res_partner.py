@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+
+from ..tools import identidad
+
+
+class ResPartner(models.Model):
+    _inherit = 'res.partner'
+
+    extractos_nif_normalizado = fields.Char(
+        string='NIF Normalizado',
+        compute='_compute_extractos_nif_normalizado',
+        store=True,
+        index=True,
+        help='NIF sin prefijo de país ni separadores, con la letra de control, para identificar los pagos de los extractos'
+    )
+    
+    @api.depends('vat')
+    def _compute_extractos_nif_normalizado(self):
+        for partner in self:
+            partner.extractos_nif_normalizado = identidad.normalizar_documento(partner.vat)
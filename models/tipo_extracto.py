@@ -2,6 +2,19 @@
 
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
+from odoo.tools import frozendict, ormcache
+import codecs
+import importlib.util
+
+from ..tools import columnas
+
+# Campos de lectura cuyo cambio obliga a volver a aprender el perfil de formato
+CAMPOS_LECTURA = {'formato', 'skiprows', 'first_row_headers', 'usecols', 'columna_fecha', 'columna_importe'}
+# Campos compilados en el plan de extracción cacheado (``_plan_configuracion``)
+CAMPOS_PLAN = CAMPOS_LECTURA | {
+    'lectura_por_bloques', 'tamano_bloque', 'memoria_maxima_mb', 'motor_csv', 'delimitador',
+    'codificacion', 'umbral_reaprendizaje', 'columna_concepto', 'columna_ordenante',
+}
 
 
 class ExtractosTipoExtracto(models.Model):
@@ -55,6 +68,87 @@ class ExtractosTipoExtracto(models.Model):
         help='Letra de la columna donde está el ordenante/interviniente (ej: A, B, C, etc.). Opcional'
     )
     
+    lectura_por_bloques = fields.Boolean(
+        string='Lectura por Bloques',
+        default=False,
+        help='Lee los archivos XLS/XLSX fila a fila y crea las líneas en bloques, '
+             'para importar extractos grandes con un consumo de memoria acotado. '
+             'En XLS el libro se carga siempre completo: solo se acotan los bloques'
+    )
+    
+    tamano_bloque = fields.Integer(
+        string='Filas por Bloque',
+        default=5000,
+        help='Número máximo de filas que se crean en cada bloque (y que se leen en cada bloque '
+             'de los libros leídos por bloques), y de líneas que se auto-asignan entre cada '
+             'confirmación en segundo plano'
+    )
+    
+    memoria_maxima_mb = fields.Integer(
+        string='Memoria Máxima por Bloque (MB)',
+        default=64,
+        help='Límite aproximado de memoria de las filas leídas en cada bloque; '
+             'si se alcanza, el bloque se reduce por debajo de las filas configuradas'
+    )
+    
+    motor_csv = fields.Selection([
+        ('pandas', 'Pandas'),
+        ('arrow', 'Arrow (columnar, multihilo)'),
+    ], string='Motor de Lectura', default='pandas', required=True,
+        help='Motor para archivos CSV/TXT. Arrow lee en varios hilos solo las columnas configuradas '
+             'y entrega números y fechas ya convertidos; recomendado para archivos muy grandes'
+    )
+    
+    delimitador = fields.Selection([
+        (',', 'Coma (,)'),
+        (';', 'Punto y coma (;)'),
+        ('\t', 'Tabulador'),
+        ('|', 'Barra vertical (|)'),
+    ], string='Delimitador', help='Delimitador de los archivos CSV/TXT. Si se deja vacío, coma para CSV y tabulador para TXT')
+    
+    codificacion = fields.Char(
+        string='Codificación',
+        default='utf-8',
+        help='Codificación de los archivos CSV/TXT (ej: utf-8, latin-1, cp1252)'
+    )
+    
+    importacion_en_segundo_plano = fields.Boolean(
+        string='Importar en Segundo Plano',
+        default=False,
+        help='El botón Importar deja el extracto en cola y una tarea programada lo importa por bloques, '
+             'notificando el progreso al usuario'
+    )
+    
+    # Perfil de formato aprendido de las primeras filas importadas
+    perfil_aprendido = fields.Boolean(string='Perfil Aprendido', readonly=True, copy=False)
+    perfil_fecha_aprendizaje = fields.Datetime(string='Fecha de Aprendizaje', readonly=True, copy=False)
+    perfil_formato_fecha = fields.Char(string='Formato de Fecha', readonly=True, copy=False)
+    perfil_fecha_serial = fields.Boolean(
+        string='Fecha como Número de Serie Excel',
+        readonly=True,
+        copy=False
+    )
+    perfil_separador_decimal = fields.Selection([
+        ('punto', 'Punto'),
+        ('coma', 'Coma'),
+    ], string='Separador Decimal', readonly=True, copy=False)
+    perfil_separador_miles = fields.Selection([
+        ('ninguno', 'Ninguno'),
+        ('punto', 'Punto'),
+        ('coma', 'Coma'),
+    ], string='Separador de Miles', readonly=True, copy=False)
+    perfil_signo = fields.Selection([
+        ('prefijo', 'Signo delante (-10,00)'),
+        ('sufijo', 'Signo detrás (10,00-)'),
+        ('parentesis', 'Paréntesis ((10,00))'),
+    ], string='Signo', readonly=True, copy=False)
+    umbral_reaprendizaje = fields.Float(
+        string='Umbral de Reaprendizaje (%)',
+        default=20.0,
+        help='Si el porcentaje de fechas o importes que no encajan con el perfil aprendido supera este umbral, '
+             'el perfil se vuelve a aprender'
+    )
+    
     active = fields.Boolean(string='Activo', default=True)
     
     extracto_ids = fields.One2many('extractos.extracto', 'tipo_extracto_id', string='Extractos')
@@ -70,4 +164,111 @@ class ExtractosTipoExtracto(models.Model):
                 pattern = r'^[A-Z]+:[A-Z]+$'
                 if not re.match(pattern, record.usecols.strip().upper()):
                     raise ValidationError(_('El formato de columnas debe ser como "C:M" (letra:letra)'))
-
+    
+    @api.constrains('codificacion')
+    def _check_codificacion(self):
+        """Valida que la codificación exista"""
+        for record in self:
+            if record.codificacion:
+                try:
+                    codecs.lookup(record.codificacion)
+                except LookupError:
+                    raise ValidationError(_('La codificación %s no existe.') % record.codificacion)
+    
+    @api.constrains('motor_csv')
+    def _check_motor_csv(self):
+        """El motor Arrow necesita pyarrow instalado en el servidor"""
+        for record in self:
+            if record.motor_csv == 'arrow' and not importlib.util.find_spec('pyarrow'):
+                raise ValidationError(_('El motor Arrow necesita la librería pyarrow instalada en el servidor.'))
+    
+    def write(self, vals):
+        """Descarta el perfil aprendido si cambia la forma de leer el archivo e invalida el plan cacheado.
+        
+        Guardar el perfil no toca los campos del plan, así que no vacía la caché.
+        """
+        if CAMPOS_LECTURA.intersection(vals) and 'perfil_aprendido' not in vals:
+            vals = dict(vals, perfil_aprendido=False)
+        res = super().write(vals)
+        if CAMPOS_PLAN.intersection(vals):
+            self.env.registry.clear_cache()
+        return res
+    
+    def _plan_extraccion(self):
+        """Plan de extracción reutilizable por todas las importaciones, con el perfil aprendido actual.
+        
+        Es inmutable, y quien necesite variarlo trabaja sobre una copia (``dict(plan, ...)``).
+        """
+        self.ensure_one()
+        perfil = frozendict(self._perfil_formato()) if self.perfil_aprendido else None
+        return frozendict(self._plan_configuracion(), perfil=perfil)
+    
+    @ormcache('self.id')
+    def _plan_configuracion(self):
+        """Compila la configuración en la parte del plan de extracción que no depende del perfil.
+        
+        Se cachea a nivel de registro por tipo y se invalida en ``write`` al cambiar alguno
+        de los ``CAMPOS_PLAN`` (la fecha de modificación no sirve de clave: es la misma en
+        todas las escrituras de una transacción).
+        """
+        self.ensure_one()
+        inicio_columna, fin_columna = columnas.rango_columnas(self.usecols)
+        return frozendict({
+            'formato': self.formato,
+            'skiprows': self.skiprows,
+            'first_row_headers': self.first_row_headers,
+            'inicio_columna': inicio_columna,
+            'fin_columna': fin_columna,
+            'lectura_por_bloques': self.lectura_por_bloques,
+            'tamano_bloque': self.tamano_bloque,
+            'memoria_maxima_mb': self.memoria_maxima_mb,
+            'motor_csv': self.motor_csv,
+            'delimitador': self.delimitador or False,
+            'codificacion': self.codificacion or False,
+            'umbral_reaprendizaje': self.umbral_reaprendizaje / 100.0,
+            # (campo, índice de la columna configurada, cabeceras alternativas)
+            'columnas': (
+                ('fecha', columnas.columna_a_indice(self.columna_fecha), columnas.CABECERAS_FECHA),
+                ('importe', columnas.columna_a_indice(self.columna_importe), columnas.CABECERAS_IMPORTE),
+                ('concepto', columnas.columna_a_indice(self.columna_concepto), columnas.CABECERAS_CONCEPTO),
+                ('ordenante', columnas.columna_a_indice(self.columna_ordenante), columnas.CABECERAS_ORDENANTE),
+                ('observaciones', None, columnas.CABECERAS_OBSERVACIONES),
+            ),
+        })
+    
+    def _perfil_formato(self):
+        """Perfil de formato aprendido, en el formato usado por la normalización"""
+        self.ensure_one()
+        return {
+            'formato_fecha': self.perfil_formato_fecha or False,
+            'fecha_serial': self.perfil_fecha_serial,
+            'separador_decimal': self.perfil_separador_decimal or 'punto',
+            'separador_miles': self.perfil_separador_miles or 'ninguno',
+            'signo': self.perfil_signo or 'prefijo',
+        }
+    
+    def _guardar_perfil(self, perfil):
+        """Guarda el perfil de formato aprendido, solo si cambia.
+        
+        Escribir bloquea la fila del tipo de extracto hasta el final de la transacción,
+        lo que serializaría las importaciones simultáneas del mismo tipo.
+        """
+        self.ensure_one()
+        valores = {
+            'perfil_formato_fecha': perfil['formato_fecha'] or False,
+            'perfil_fecha_serial': bool(perfil['fecha_serial']),
+            'perfil_separador_decimal': perfil['separador_decimal'] or False,
+            'perfil_separador_miles': perfil['separador_miles'] or False,
+            'perfil_signo': perfil['signo'] or False,
+        }
+        if self.perfil_aprendido and all(self[campo] == valor for campo, valor in valores.items()):
+            return
+        self.sudo().write(dict(
+            valores,
+            perfil_aprendido=True,
+            perfil_fecha_aprendizaje=fields.Datetime.now(),
+        ))
+    
+    def action_olvidar_perfil(self):
+        """Descarta el perfil aprendido para que se aprenda en la próxima importación"""
+        self.write({'perfil_aprendido': False})
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+from . import test_importacion
+from . import test_distribucion
+from . import test_indices
+from . import test_procesado
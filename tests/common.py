@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import base64
+
+from odoo.tests import TransactionCase
+
+
+class ExtractosCase(TransactionCase):
+    """Cartera de pruebas con su prestamista y tipo de extracto"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.prestamista = cls.env['res.partner'].create({'name': 'Prestamista de Pruebas'})
+        cls.tipo_extracto = cls.env['extractos.tipo_extracto'].create({
+            'name': 'Banco de Pruebas',
+            'formato': 'csv',
+            'delimitador': ';',
+        })
+        cls.cartera = cls.env['extractos.cartera'].create({
+            'prestamista_id': cls.prestamista.id,
+            'tipo_extracto_id': cls.tipo_extracto.id,
+        })
+        cls.Linea = cls.env['extractos.extracto_linea']
+
+    @classmethod
+    def _crear_extracto(cls):
+        return cls.env['extractos.extracto'].create({
+            'cartera_id': cls.cartera.id,
+            'file': base64.b64encode(b'FECHA;IMPORTE;OBSERVACIONES\n'),
+            'file_name': 'extracto.csv',
+        })
+
+    @classmethod
+    def _crear_prestamo(cls, nombre):
+        return cls.env['linx.prestamo'].create({
+            'name': nombre,
+            'prestamista_id': cls.prestamista.id,
+            'state': 'formalized',
+        })
+
+    @classmethod
+    def _crear_lineas(cls, extracto, vals_list):
+        return cls.Linea.create([
+            dict({'extracto_id': extracto.id, 'fecha': '2024-03-15'}, **vals) for vals in vals_list
+        ])
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""Las pruebas de ``tools`` no necesitan Odoo: se importan desde la raíz del módulo.
+
+Están fuera del paquete ``tests`` (sin ``__init__.py``) para que pytest no importe el
+módulo de Odoo al recogerlas; las pruebas de Odoo están en ``tests``.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from tools import identidad
+
+
+@pytest.mark.parametrize('texto, esperado', [
+    ('12345678z', '12345678Z'),
+    ('12.345.678', '12345678Z'),
+    ('ES12345678Z', '12345678Z'),
+    ('1234567L', '01234567L'),
+    ('1234567', '01234567L'),
+    ('01234567L', '01234567L'),
+    ('x1234567', 'X1234567L'),
+    ('B12345678', 'B12345678'),
+    ('', False),
+    (False, False),
+])
+def test_normalizar_documento(texto, esperado):
+    assert identidad.normalizar_documento(texto) == esperado
+
+
+def test_dni_de_siete_cifras_coincide_con_el_completo():
+    assert identidad.normalizar_documento('1234567L') == identidad.normalizar_documento('01234567-L')
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+import mmap
+
+import pytest
+
+from tools import lectores
+from tools.columnas import CABECERAS_FECHA, CABECERAS_IMPORTE, CABECERAS_OBSERVACIONES
+
+
+def _plan(**valores):
+    plan = {
+        'formato': 'csv',
+        'skiprows': 0,
+        'first_row_headers': True,
+        'inicio_columna': None,
+        'fin_columna': None,
+        'lectura_por_bloques': False,
+        'tamano_bloque': 1000,
+        'memoria_maxima_mb': 0,
+        'motor_csv': 'pandas',
+        'delimitador': ';',
+        'codificacion': 'utf-8',
+        'perfil': None,
+        'umbral_reaprendizaje': 0.2,
+        'columnas': (
+            ('fecha', None, CABECERAS_FECHA),
+            ('importe', None, CABECERAS_IMPORTE),
+            ('concepto', None, ()),
+            ('ordenante', None, ()),
+            ('observaciones', None, CABECERAS_OBSERVACIONES),
+        ),
+    }
+    plan.update(valores)
+    return plan
+
+
+def _proyectar(tmp_path, contenido):
+    ruta = tmp_path / 'extracto.csv'
+    ruta.write_bytes(contenido)
+    archivo = open(ruta, 'rb')
+    return archivo, lectores.ArchivoProyectado(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@pytest.mark.parametrize('motor', ['pandas', 'arrow'])
+def test_leer_csv_proyectado(tmp_path, motor):
+    pytest.importorskip('pandas')
+    if motor == 'arrow':
+        pytest.importorskip('pyarrow.csv')
+    archivo, data = _proyectar(tmp_path, 'FECHA;IMPORTE;OBSERVACIONES\n15/03/2024;10;Recibo\n'.encode())
+    with archivo:
+        df = next(lectores.leer(data, _plan(motor_csv=motor)))
+        assert len(df) == 1
+        del df
+        lectores.cerrar_proyeccion(data)
+
+
+def test_cerrar_proyeccion_conserva_el_error_del_lector(tmp_path):
+    pytest.importorskip('pyarrow.csv')
+    archivo, data = _proyectar(tmp_path, 'FECHA;IMPORTE;OBSERVACIONES\n15/03/2024;10;Año\n'.encode('latin-1'))
+    with archivo, pytest.raises(Exception) as error:
+        try:
+            next(lectores.leer(data, _plan(motor_csv='arrow')))
+        finally:
+            lectores.cerrar_proyeccion(data)
+    assert not isinstance(error.value, BufferError)
+
+
+@pytest.mark.parametrize('first_row_headers', [True, False])
+def test_filas_a_dataframe_igual_que_por_bloques(first_row_headers):
+    pd = pytest.importorskip('pandas')
+    filas = [('FECHA', 'IMPORTE', 'IMPORTE'), ('15/03/2024', 10.0, 1.0), ('', '', ''), ('16/03/2024', 20.0)]
+    plan = _plan(first_row_headers=first_row_headers)
+    completo = lectores.filas_a_dataframe(filas, plan)
+    [por_bloques] = lectores.agrupar_en_bloques(filas, plan)
+    pd.testing.assert_frame_equal(completo, por_bloques)
+    assert len(completo) == 3 - first_row_headers
+
+
+def test_leer_normalizado_reaprende_el_perfil(tmp_path):
+    pytest.importorskip('pandas')
+    perfil = {
+        'formato_fecha': '%Y-%m-%d',
+        'fecha_serial': False,
+        'separador_decimal': 'punto',
+        'separador_miles': 'ninguno',
+        'signo': 'prefijo',
+    }
+    contenido = 'FECHA;IMPORTE;OBSERVACIONES\n15/03/2024;10,50;Recibo\n16/03/2024;1.200,00;Recibo\n'.encode()
+    archivo, data = _proyectar(tmp_path, contenido)
+    with archivo:
+        [datos], aprendido = lectores.leer_normalizado(data, _plan(perfil=perfil))
+        del datos
+        lectores.cerrar_proyeccion(data)
+    assert aprendido['formato_fecha'] == '%d/%m/%Y'
+    assert aprendido['separador_decimal'] == 'coma'
+
+
+def test_leer_archivo_en_proceso_aparte(tmp_path):
+    pytest.importorskip('pandas')
+    import multiprocessing
+    import runpy
+    from concurrent.futures import ProcessPoolExecutor
+
+    from tools import proceso_lectura
+
+    ruta = tmp_path / 'extracto.csv'
+    ruta.write_bytes('FECHA;IMPORTE;OBSERVACIONES\n15/03/2024;10,50;Recibo\n'.encode())
+    leer_origen = proceso_lectura.cargar_paquete().leer_origen
+    assert leer_origen.__module__ == proceso_lectura.PAQUETE_LECTURA + '.proceso_lectura'
+    with ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=runpy.run_path,
+        initargs=(proceso_lectura.__file__, None, proceso_lectura.NOMBRE_ARRANQUE),
+    ) as executor:
+        [(hoja, [datos], perfil)] = executor.submit(leer_origen, str(ruta), _plan()).result()
+        # El proceso solo carga el paquete de lectura, no el módulo que lo contiene
+        importados = executor.submit(eval, "[m for m in __import__('sys').modules if m.split('.')[0] in ('tools', 'odoo')]")
+        assert importados.result() == []
+    assert hoja is False
+    assert datos['importe'].tolist() == [10.5]
+    assert perfil['separador_decimal'] == 'coma'
+
+
+def test_leer_origen_vacio_o_en_bytes(tmp_path):
+    pytest.importorskip('pandas')
+    from tools import proceso_lectura
+
+    ruta = tmp_path / 'vacio.csv'
+    ruta.write_bytes(b'')
+    with proceso_lectura.abrir(str(ruta)) as data:
+        assert data == b''
+    contenido = 'FECHA;IMPORTE;OBSERVACIONES\n15/03/2024;10,50;Recibo\n'.encode()
+    [(hoja, [datos], perfil)] = proceso_lectura.leer_origen(contenido, _plan())
+    assert datos['importe'].tolist() == [10.5]
+
+
+def test_leer_archivo_todas_las_hojas():
+    openpyxl = pytest.importorskip('openpyxl')
+    pytest.importorskip('pandas')
+    import io
+
+    libro = openpyxl.Workbook()
+    libro.active.title = 'Enero'
+    libro.active.append(['FECHA', 'IMPORTE', 'OBSERVACIONES'])
+    libro.active.append(['15/03/2024', 10, 'Recibo'])
+    febrero = libro.create_sheet('Febrero')
+    febrero.append(['FECHA', 'IMPORTE', 'OBSERVACIONES'])
+    febrero.append(['16/03/2024', 20, 'Recibo'])
+    buffer = io.BytesIO()
+    libro.save(buffer)
+
+    leidas = lectores.leer_archivo(buffer.getvalue(), _plan(formato='xlsx'), todas_las_hojas=True)
+    assert [hoja for hoja, _bloques, _perfil in leidas] == ['Enero', 'Febrero']
+    assert [bloques[0]['importe'].tolist() for _hoja, bloques, _perfil in leidas] == [[10.0], [20.0]]
+
+
+def test_leer_xlsx_igual_con_y_sin_bloques():
+    openpyxl = pytest.importorskip('openpyxl')
+    pytest.importorskip('pandas')
+    import io
+
+    libro = openpyxl.Workbook()
+    libro.active.append(['FECHA', 'IMPORTE', 'OBSERVACIONES'])
+    libro.active.append(['15/03/2024', 10, 'Recibo'])
+    libro.active.append([None, None, None])
+    libro.active.append(['16/03/2024', 20, 'Recibo'])
+    buffer = io.BytesIO()
+    libro.save(buffer)
+
+    leidas = {}
+    for lectura_por_bloques in (False, True):
+        plan = _plan(formato='xlsx', lectura_por_bloques=lectura_por_bloques)
+        bloques, _perfil = lectores.leer_normalizado(buffer.getvalue(), plan)
+        leidas[lectura_por_bloques] = [
+            (fecha, importe) for datos in bloques for fecha, importe in zip(datos['fecha'], datos['importe'])
+        ]
+    assert leidas[False] == leidas[True]
+    assert [importe for _fecha, importe in leidas[False]] == [10.0, 20.0]
+
+
+def test_leer_xlsx_con_dimension_incorrecta():
+    openpyxl = pytest.importorskip('openpyxl')
+    pytest.importorskip('pandas')
+    import io
+    import re
+    import zipfile
+
+    libro = openpyxl.Workbook()
+    libro.active.append(['FECHA', 'IMPORTE', 'OBSERVACIONES'])
+    libro.active.append(['15/03/2024', 10, 'Recibo'])
+    libro.active.append(['16/03/2024', 20, 'Recibo'])
+    buffer = io.BytesIO()
+    libro.save(buffer)
+
+    # Los bancos suelen exportar la dimensión como "A1" aunque la hoja tenga más celdas
+    salida = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(buffer.getvalue())) as zin, zipfile.ZipFile(salida, 'w') as zout:
+        for item in zin.infolist():
+            contenido = zin.read(item)
+            if item.filename == 'xl/worksheets/sheet1.xml':
+                contenido = re.sub(rb'<dimension ref="[^"]*" ?/>', b'<dimension ref="A1"/>', contenido)
+            zout.writestr(item, contenido)
+
+    plan = _plan(formato='xlsx', lectura_por_bloques=True)
+    bloques, _perfil = lectores.leer_normalizado(salida.getvalue(), plan)
+    assert [importe for datos in bloques for importe in datos['importe']] == [10.0, 20.0]
+
+
+def test_reparar_estilos_xlsx_conserva_los_miembros():
+    openpyxl = pytest.importorskip('openpyxl')
+    import io
+    import zipfile
+
+    libro = openpyxl.Workbook()
+    libro.active.append(['FECHA', 'IMPORTE', 'OBSERVACIONES'])
+    libro.active.append(['15/03/2024', 10, 'Recibo'])
+    buffer = io.BytesIO()
+    libro.save(buffer)
+
+    # Estilos con un <fill/> vacío, como los de algunos bancos, y un miembro sin comprimir
+    original = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(buffer.getvalue())) as zin, zipfile.ZipFile(original, 'w') as zout:
+        for item in zin.infolist():
+            contenido = zin.read(item)
+            if item.filename == 'xl/styles.xml':
+                contenido = contenido.replace(b'<fills count="2">', b'<fills count="3"><fill/>')
+            if item.filename == 'docProps/app.xml':
+                item.compress_type = zipfile.ZIP_STORED
+            zout.writestr(item, contenido)
+
+    reparado = lectores.reparar_estilos_xlsx(original.getvalue())
+    with zipfile.ZipFile(io.BytesIO(original.getvalue())) as antes, zipfile.ZipFile(io.BytesIO(reparado)) as despues:
+        assert b'<fill/>' not in despues.read('xl/styles.xml')
+        assert [item.filename for item in despues.infolist()] == [item.filename for item in antes.infolist()]
+        for item in antes.infolist():
+            assert despues.getinfo(item.filename).compress_type == item.compress_type
+            if item.filename != 'xl/styles.xml':
+                assert despues.read(item.filename) == antes.read(item)
+    hoja = openpyxl.load_workbook(io.BytesIO(reparado)).active
+    assert [fila for fila in hoja.iter_rows(values_only=True)] == [
+        ('FECHA', 'IMPORTE', 'OBSERVACIONES'), ('15/03/2024', 10, 'Recibo'),
+    ]
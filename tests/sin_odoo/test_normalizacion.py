@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+from tools import normalizacion  # noqa: E402
+
+PERFIL_COMA = {
+    'formato_fecha': '%d/%m/%Y',
+    'fecha_serial': False,
+    'separador_decimal': 'coma',
+    'separador_miles': 'punto',
+    'signo': 'prefijo',
+}
+
+COLUMNAS = (
+    ('fecha', None, ('FECHA',)),
+    ('importe', None, ('IMPORTE',)),
+    ('concepto', None, ('CONCEPTO',)),
+    ('ordenante', None, ()),
+    ('observaciones', None, ('OBSERVACIONES',)),
+)
+
+
+def _extracto(filas):
+    return pd.DataFrame(filas, columns=['FECHA', 'IMPORTE', 'CONCEPTO', 'OBSERVACIONES'])
+
+
+def test_importes_con_perfil_texto():
+    serie = pd.Series(['1.234,56', '-12,50', '7'], dtype=object)
+    assert normalizacion.importes_con_perfil(serie, PERFIL_COMA).tolist() == [1234.56, -12.5, 7.0]
+
+
+def test_importes_con_perfil_conserva_celdas_numericas():
+    serie = pd.Series([12.5, '1.234,56', 3], dtype=object)
+    assert normalizacion.importes_con_perfil(serie, PERFIL_COMA).tolist() == [12.5, 1234.56, 3.0]
+
+
+def test_importes_con_perfil_signo_sufijo_y_parentesis():
+    sufijo = dict(PERFIL_COMA, signo='sufijo')
+    parentesis = dict(PERFIL_COMA, signo='parentesis')
+    assert normalizacion.importes_con_perfil(pd.Series(['10,00-', '5,00']), sufijo).tolist() == [-10.0, 5.0]
+    assert normalizacion.importes_con_perfil(pd.Series(['(10,00)', '5,00']), parentesis).tolist() == [-10.0, 5.0]
+
+
+def test_limpiar_importes_detecta_separador_decimal():
+    serie = pd.Series(['1.234,56', '1,234.56', '€ 12', 'x'], dtype=object)
+    resultado = normalizacion.limpiar_importes(serie)
+    assert resultado[:3].tolist() == [1234.56, 1234.56, 12.0]
+    assert pd.isna(resultado[3])
+
+
+def test_convertir_fechas_texto_serial_y_vacias():
+    hoy = date(2024, 1, 31)
+    serie = pd.Series(['15/03/2024', 45366, None], dtype=object)
+    assert normalizacion.convertir_fechas(serie, hoy=hoy).tolist() == [date(2024, 3, 15), date(2024, 3, 15), hoy]
+
+
+def test_aprender_perfil():
+    df = _extracto([
+        ['15/03/2024', '1.234,56', 'A', ''],
+        ['16/03/2024', '-12,50', 'B', ''],
+    ])
+    perfil = normalizacion.aprender_perfil(df, {'columnas': COLUMNAS})
+    assert perfil['formato_fecha'] == '%d/%m/%Y'
+    assert perfil['separador_decimal'] == 'coma'
+    assert perfil['separador_miles'] == 'punto'
+    assert perfil['signo'] == 'prefijo'
+
+
+def test_normalizar_con_perfil():
+    df = _extracto([
+        ['15/03/2024', '1.234,56', 'Recibo', 'HIS 1'],
+        ['16/03/2024', 12.5, None, None],
+    ])
+    datos = normalizacion.normalizar(df, {'columnas': COLUMNAS, 'perfil': PERFIL_COMA})
+    assert datos['fecha'].tolist() == [date(2024, 3, 15), date(2024, 3, 16)]
+    assert datos['importe'].tolist() == [1234.56, 12.5]
+    assert datos['concepto'].tolist() == ['Recibo', '']
+    assert datos.attrs['tasa_fallos'] == 0.0
+
+
+def test_normalizar_omite_filas_anteriores_a_fecha_minima():
+    df = _extracto([
+        ['14/03/2024', '1,00', 'A', ''],
+        ['15/03/2024', '2,00', 'B', ''],
+    ])
+    plan = {'columnas': COLUMNAS, 'perfil': PERFIL_COMA, 'fecha_minima': date(2024, 3, 15)}
+    datos = normalizacion.normalizar(df, plan)
+    assert datos['importe'].tolist() == [2.0]
+    assert datos.attrs['filas_omitidas'] == 1
+
+
+def test_normalizar_marca_fechas_no_interpretadas():
+    df = _extracto([
+        ['15/03/2024', '1,00', 'A', ''],
+        ['TOTAL', '1,00', '', ''],
+    ])
+    for perfil in (PERFIL_COMA, None):
+        datos = normalizacion.normalizar(df, {'columnas': COLUMNAS, 'perfil': perfil})
+        assert datos['fecha_leida'].tolist() == [True, False]
+        assert datos['fecha'].tolist() == [date(2024, 3, 15), date.today()]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from tools import parametros
+
+
+class _Parametros(dict):
+    def get_param(self, clave, defecto=False):
+        return self.get(clave, defecto)
+
+
+@pytest.mark.parametrize('valor, esperado', [
+    (None, 1),
+    ('3', 3),
+    (' 2 ', 2),
+    ('tres', 1),
+    ('', 1),
+    ('-1', 1),
+])
+def test_entero(valor, esperado):
+    ICP = _Parametros() if valor is None else _Parametros({'extractos.cuotas_adicionales': valor})
+    assert parametros.entero(ICP, 'extractos.cuotas_adicionales', 1) == esperado
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+from tools.reparto import calcular_reparto
+
+
+def _fila(importe, concepto='Capital', enabled=True):
+    return {'importe': importe, 'concepto': concepto, 'enabled': enabled}
+
+
+def test_pago_completo_y_parcial():
+    pagos, pago_parcial, distribuido = calcular_reparto(150, [_fila(100), _fila(100)])
+    assert pagos == [(100, False), (50, True)]
+    assert pago_parcial is True
+    assert distribuido == 150
+
+
+def test_pago_exacto():
+    pagos, pago_parcial, distribuido = calcular_reparto(100, [_fila(100), _fila(100)])
+    assert pagos == [(100, False), (0, False)]
+    assert pago_parcial is False
+    assert distribuido == 100
+
+
+def test_filas_deshabilitadas_moras_y_penalizaciones():
+    filas = [_fila(10, 'Penalización'), _fila(10, 'Mora'), _fila(10, enabled=False), _fila(10)]
+    pagos, _pago_parcial, distribuido = calcular_reparto(
+        100, filas, aplicar_moras=False, aplicar_penalizaciones=False
+    )
+    assert pagos == [(0, False), (0, False), (0, False), (10, False)]
+    assert distribuido == 10
+
+
+def test_sin_filas_pagadas_conserva_pago_parcial():
+    pagos, pago_parcial, distribuido = calcular_reparto(0, [_fila(10)], pago_parcial=True)
+    assert pagos == [(0, False)]
+    assert pago_parcial is True
+    assert distribuido == 0
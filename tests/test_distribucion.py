@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+from unittest.mock import patch
+
+from odoo.tests import Form, tagged
+
+from .common import ExtractosCase
+
+
+@tagged('post_install', '-at_install')
+class TestDistribucion(ExtractosCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.conceptos = cls.env['linx.import.pagos.distribucion.conceptos']._ids_conceptos(
+            ['Prueba A', 'Prueba B', 'Prueba C']
+        )
+        cls.prestamo = cls._crear_prestamo('HIS 54321')
+        [cls.linea] = cls._crear_lineas(cls._crear_extracto(), [{
+            'importe': 30.0,
+            'observaciones': 'Recibo',
+            'prestamo_id': cls.prestamo.id,
+            'fecha_calculo': '2024-03-15',
+        }])
+        Distribucion = cls.env['extractos.extracto_linea_distribucion']
+        cls.fila_a, cls.fila_a_repetida, cls.fila_b = Distribucion.create([{
+            'linea_id': cls.linea.id,
+            'orden': orden,
+            'fecha': '2024-03-01',
+            'importe': 10.0,
+            'concepto_id': cls.conceptos[concepto],
+        } for orden, concepto in enumerate(['Prueba A', 'Prueba A', 'Prueba B'], start=1)])
+
+    def _fila(self, concepto, importe, orden):
+        clave = (False, self.conceptos[concepto], False)
+        return clave, {
+            'fecha': date(2024, 3, 1),
+            'importe': importe,
+            'concepto_id': self.conceptos[concepto],
+            'cuota_id': False,
+            'enabled': True,
+            'extraordinario': False,
+            'orden': orden,
+        }
+
+    def test_reconciliar_distribucion(self):
+        filas = [self._fila('Prueba A', 12.0, 1), self._fila('Prueba C', 5.0, 2)]
+        crear, actualizar, eliminar = self.linea._reconciliar_distribucion(filas)
+        self.assertEqual(crear, [dict(filas[1][1], linea_id=self.linea.id)])
+        self.assertEqual(actualizar, {(('importe', 12.0),): [self.fila_a.id]})
+        self.assertEqual(eliminar, [self.fila_a_repetida.id, self.fila_b.id])
+
+    def test_reconciliar_distribucion_sin_cambios(self):
+        filas = [self._fila('Prueba A', 10.0, 1), self._fila('Prueba B', 10.0, 3)]
+        crear, actualizar, eliminar = self.linea._reconciliar_distribucion(filas)
+        self.assertEqual((crear, actualizar, eliminar), ([], {}, [self.fila_a_repetida.id]))
+
+    def test_previsualizacion_no_escribe(self):
+        Conceptos = self.env['linx.import.pagos.distribucion.conceptos']
+        num_conceptos = Conceptos.search_count([])
+        form = Form(self.linea, view='extractos.view_extracto_linea_distribucion_form')
+        form.fecha_calculo = date(2024, 3, 20)
+        # El préstamo no tiene cuotas pendientes: la previsualización quita las filas de deuda
+        self.assertEqual(len(form.distribucion_ids), 0)
+
+        self.env.invalidate_all()
+        self.assertEqual(self.linea.distribucion_ids, self.fila_a | self.fila_a_repetida | self.fila_b)
+        self.assertEqual(self.linea.fecha_calculo, date(2024, 3, 15))
+        self.assertEqual(Conceptos.search_count([]), num_conceptos)
+
+    def test_previsualizacion_calcula_el_reparto_una_vez(self):
+        [linea] = self._crear_lineas(self._crear_extracto(), [{'importe': 30.0, 'observaciones': 'Recibo'}])
+        Distribucion = self.env['extractos.extracto_linea_distribucion']
+        Distribucion.create([{
+            'linea_id': linea.id,
+            'orden': orden,
+            'fecha': '2024-03-01',
+            'importe': 10.0,
+            'concepto_id': self.conceptos[concepto],
+            'extraordinario': extraordinario,
+        } for orden, concepto, extraordinario in [(1, 'Prueba A', False), (2, 'Prueba C', True)]])
+        form = Form(linea, view='extractos.view_extracto_linea_distribucion_form')
+        Linea = type(self.Linea)
+        with patch.object(Linea, '_calcular_reparto', autospec=True, side_effect=Linea._calcular_reparto) as reparto:
+            form.prestamo_id = self.prestamo
+        # La fila de deuda desaparece y el extraordinario se reparte una sola vez
+        self.assertEqual(reparto.call_count, 1)
+        self.assertEqual(len(form.distribucion_ids), 1)
+        with form.distribucion_ids.edit(0) as fila:
+            self.assertEqual(fila.importe_pagado, 10.0)
+
+    def test_distribuye_escribe_una_vez_por_valores(self):
+        [otra] = self._crear_lineas(self._crear_extracto(), [{'importe': 15.0, 'observaciones': 'Recibo'}])
+        Distribucion = self.env['extractos.extracto_linea_distribucion']
+        Distribucion.create([{
+            'linea_id': otra.id,
+            'orden': orden,
+            'fecha': '2024-03-01',
+            'importe': 10.0,
+            'concepto_id': self.conceptos[concepto],
+        } for orden, concepto in enumerate(['Prueba A', 'Prueba B'], start=1)])
+        lineas = self.linea | otra
+        with patch.object(type(Distribucion), 'write', autospec=True, side_effect=type(Distribucion).write) as escrituras:
+            lineas.distribuye()
+        # Filas pagadas enteras (10) en las dos líneas y una pagada en parte (5): dos escrituras
+        self.assertEqual(escrituras.call_count, 2)
+        self.assertEqual(otra.distribucion_ids.mapped('importe_pagado'), [10.0, 5.0])
+        self.assertEqual(lineas.mapped('pago_parcial'), [False, True])
+        self.assertEqual(lineas.mapped('revisado'), [True, False])
+
+    def test_cargar_mas_cuotas_mantiene_la_fecha_de_calculo(self):
+        self.linea.fecha_calculo = date(2024, 4, 1)
+        self.linea.action_cargar_mas_cuotas()
+        self.assertEqual(self.linea.fecha_calculo, date(2024, 4, 1))
+        self.assertEqual(self.linea.cuotas_extra, 5)
+        self.linea.actualiza_lista_distribucion()
+        self.assertEqual(self.linea.fecha_calculo, self.linea.fecha)
+
+    def test_conceptos_vacios_y_archivados_no_se_crean(self):
+        Conceptos = self.env['linx.import.pagos.distribucion.conceptos']
+        archivado = Conceptos.create({'name': 'Prueba Archivada'})
+        archivado.active = False
+        num_conceptos = Conceptos.with_context(active_test=False).search_count([])
+        ids = Conceptos._ids_conceptos(['', 'Prueba Archivada', 'Prueba A'])
+        self.assertEqual(ids, {'': False, 'Prueba Archivada': archivado.id, 'Prueba A': self.conceptos['Prueba A']})
+        self.assertEqual(Conceptos.with_context(active_test=False).search_count([]), num_conceptos)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+
+import pandas as pd
+
+from odoo import Command
+from odoo.tests import tagged
+
+from .common import ExtractosCase
+
+
+@tagged('post_install', '-at_install')
+class TestImportacion(ExtractosCase):
+
+    def _bloque(self, filas):
+        """Bloque normalizado como los que genera ``_normalizar_bloque``"""
+        return pd.DataFrame(filas, columns=['fecha', 'importe', 'concepto', 'observaciones']).assign(fecha_leida=True)
+
+    def test_huella_omite_movimientos_ya_importados(self):
+        filas = [
+            (date(2024, 3, 15), 100.0, 'Recibo', 'Cliente'),
+            (date(2024, 3, 15), 100.0, 'Recibo', 'Cliente'),
+            (date(2024, 3, 15), -20.0, 'Comisión', ''),
+        ]
+        primero = self._crear_extracto()
+        primero._importar_bloques([self._bloque(filas)])
+        # Los movimientos idénticos del mismo fichero se numeran; las descartadas también llevan huella
+        self.assertEqual(sorted(primero.linea_ids.mapped('state')), ['discarded', 'pending', 'pending'])
+        self.assertEqual(len(set(primero.linea_ids.mapped('huella'))), 3)
+
+        segundo = self._crear_extracto()
+        segundo._importar_bloques([self._bloque(filas + [(date(2024, 3, 16), 50.0, 'Recibo', 'Otro')])])
+        self.assertEqual(segundo.lineas_creadas, 1)
+        self.assertEqual(segundo.linea_ids.importe, 50.0)
+
+    def test_huella_sin_fecha_leida_no_depende_del_dia(self):
+        # Una fila sin fecha interpretable lleva la de hoy: importada otro día no debe duplicarse
+        filas = [(date(2024, 3, 15), -5.0, 'Total', ''), (date(2024, 3, 15), 30.0, 'Recibo', 'Cliente')]
+        primero = self._crear_extracto()
+        primero._importar_bloques([self._bloque(filas).assign(fecha_leida=[False, True])])
+
+        segundo = self._crear_extracto()
+        filas_otro_dia = [(date(2024, 3, 18), -5.0, 'Total', '')] + filas[1:]
+        segundo._importar_bloques([self._bloque(filas_otro_dia).assign(fecha_leida=[False, True])])
+        self.assertEqual(segundo.lineas_creadas, 0)
+        self.assertEqual(segundo.filas_leidas, 2)
+
+    def test_plan_sigue_cada_escritura_de_la_transaccion(self):
+        self.tipo_extracto.skiprows = 1
+        self.assertEqual(self.tipo_extracto._plan_extraccion()['skiprows'], 1)
+        # Misma transacción, misma write_date: el plan debe seguir la segunda escritura
+        self.tipo_extracto.write({'skiprows': 2, 'usecols': 'B:D'})
+        plan = self.tipo_extracto._plan_extraccion()
+        self.assertEqual((plan['skiprows'], plan['inicio_columna'], plan['fin_columna']), (2, 1, 3))
+
+    def test_crea_las_lineas_por_trozos(self):
+        self.tipo_extracto.tamano_bloque = 2
+        extracto = self._crear_extracto()
+        bloque = self._bloque([(date(2024, 3, dia), 10.0 * dia, 'Recibo', 'Cliente') for dia in range(1, 6)])
+        bloque.attrs['filas_omitidas'] = 1
+        trozos = list(extracto._trocear_bloques([bloque], 2))
+        self.assertEqual([len(trozo) for trozo in trozos], [2, 2, 1])
+        self.assertEqual([trozo.attrs['filas_omitidas'] for trozo in trozos], [1, 0, 0])
+
+        extracto._importar_bloques([bloque])
+        self.assertEqual((extracto.filas_leidas, extracto.filas_omitidas, extracto.lineas_creadas), (6, 1, 5))
+
+    def test_asignacion_en_bloque(self):
+        prestamo = self._crear_prestamo('HIS 12345')
+        extracto = self._crear_extracto()
+        self._crear_lineas(extracto, [{
+            'importe': 50.0,
+            'observaciones': 'TRANSFERENCIA DE PRUEBA',
+            'prestamo_id': prestamo.id,
+        }])
+        nuevas = self._crear_lineas(extracto, [
+            {'importe': 80.0, 'observaciones': 'Recibo HIS 12345'},
+            {'importe': 50.0, 'observaciones': 'TRANSFERENCIA DE PRUEBA'},
+            {'importe': 80.0, 'observaciones': 'Recibo HIS 99999'},
+        ])
+        nuevas.auto_asignar_prestamo()
+        # Por número de operación y por un pago previo de la cartera con el mismo importe y observaciones
+        self.assertEqual([linea.prestamo_id.id for linea in nuevas], [prestamo.id, prestamo.id, False])
+        self.assertEqual(nuevas.mapped('auto_asignado'), [True, True, False])
+
+    def test_clientes_por_nombre_limitados_por_palabra(self):
+        categoria = self.env['res.partner.category'].search([('name', '=', 'Cliente')], limit=1) \
+            or self.env['res.partner.category'].create({'name': 'Cliente'})
+        self.env['res.partner'].create([
+            {'name': 'Zubizarreta %s' % numero, 'category_id': [Command.link(categoria.id)]} for numero in range(7)
+        ] + [{'name': 'Olabarrieta Uno', 'category_id': [Command.link(categoria.id)]}])
+        partners_nombre = self.Linea._cargar_partners_nombre({'Zubizarreta', 'Olabarrieta', 'Inexistente'})
+        self.assertEqual(len(partners_nombre['Zubizarreta']), 5)
+        self.assertEqual(len(partners_nombre['Olabarrieta']), 1)
+        self.assertNotIn('Inexistente', partners_nombre)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import tagged
+from odoo.tools import SQL
+
+from .common import ExtractosCase
+
+
+@tagged('post_install', '-at_install')
+class TestIndices(ExtractosCase):
+    """Las consultas de la asignación de préstamos y de la actualización de la distribución
+    pueden usar sus índices.
+
+    En la tabla de pruebas el planificador preferiría recorrerla entera, así que se
+    desactiva el recorrido secuencial para ver si el índice es utilizable.
+    """
+
+    def _plan(self, dominio, modelo=None):
+        self.env.cr.execute("SET LOCAL enable_seqscan = off")
+        self.env.cr.execute(SQL('EXPLAIN %s', (modelo or self.Linea)._search(dominio).select()))
+        return '\n'.join(fila[0] for fila in self.env.cr.fetchall())
+
+    def test_pagos_previos(self):
+        plan = self._plan(self.Linea._dominio_pagos_previos(self.cartera, {10.0, 20.0}))
+        self.assertIn('extractos_extracto_linea_cartera_importe_asignada_idx', plan)
+
+    def test_pendientes_sin_prestamo(self):
+        extracto = self._crear_extracto()
+        plan = self._plan(self.Linea._dominio_pendientes_sin_prestamo(extracto.ids))
+        self.assertIn('extractos_extracto_linea_extracto_state_idx', plan)
+
+    def test_distribucion_de_las_lineas(self):
+        # Cada actualización de la distribución lee las filas de las líneas que reparte
+        lineas = self._crear_lineas(self._crear_extracto(), [{'importe': 10.0}, {'importe': 20.0}])
+        Distribucion = self.env['extractos.extracto_linea_distribucion']
+        plan = self._plan([('linea_id', 'in', lineas.ids)], Distribucion)
+        self.assertIn('extractos_extracto_linea_distribucion__linea_id_index', plan)
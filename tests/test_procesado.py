@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import ExtractosCase
+
+
+@tagged('post_install', '-at_install')
+class TestProcesado(ExtractosCase):
+
+    def test_lote_fallido_se_repite_linea_a_linea(self):
+        prestamo = self._crear_prestamo('HIS 11111')
+        lineas = self._crear_lineas(self._crear_extracto(), [{
+            'importe': importe,
+            'observaciones': 'Recibo %s' % importe,
+            'prestamo_id': prestamo.id,
+            'revisado': importe != 40.0,
+        } for importe in (10.0, 20.0, 30.0, 40.0)])
+        buena, mala, otra, sin_revisar = lineas
+
+        def crear_pagos(registros):
+            registros.write({'state': 'processed'})
+            if mala in registros:
+                raise UserError('Pago rechazado')
+
+        with patch.object(type(self.Linea), '_crear_pagos', crear_pagos):
+            procesadas, errores = lineas._procesar_lineas()
+
+        self.assertEqual(procesadas, buena | otra)
+        self.assertEqual(lineas.mapped('state'), ['processed', 'pending', 'processed', 'pending'])
+        self.assertEqual(len(errores), 2)
+        self.assertIn(mala.display_name, ''.join(errores))
+        self.assertIn(sin_revisar.display_name, ''.join(errores))
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Resolución de las columnas configuradas en los tipos de extracto.
+
+No depende de pandas para poder compilar los planes de extracción sin cargar
+ningún motor de lectura.
+"""
+
+import functools
+
+CABECERAS_IMPORTE = ('IMPORTE', 'Importe', 'importe', 'IMPORT', 'Import', 'amount', 'Amount', 'AMOUNT')
+CABECERAS_FECHA = ('F. CONTABLE', 'FECHA', 'Fecha', 'fecha', 'FECHA CONTABLE', 'date', 'Date', 'DATE')
+CABECERAS_CONCEPTO = ('CONCEPTO', 'Concepto', 'concepto', 'CONCEPT', 'Concept')
+CABECERAS_ORDENANTE = ('ORDENANTE', 'Ordenante', 'ordenante', 'INTERVINIENTE', 'Interviniente', 'interviniente')
+CABECERAS_OBSERVACIONES = (
+    'OBSERVACIONES', 'Observaciones', 'observaciones', 'OBS', 'Obs',
+    'DESCRIPCION', 'Descripcion', 'DETALLE', 'Detalle',
+)
+
+
+def columna_a_indice(columna_letra):
+    """Convierte una letra de columna (A, B, C, etc.) a índice numérico (0, 1, 2, etc.)"""
+    if not columna_letra:
+        return None
+    columna_letra = columna_letra.strip().upper()
+    indice = 0
+    for char in columna_letra:
+        indice = indice * 26 + (ord(char) - ord('A') + 1)
+    return indice - 1
+
+
+def rango_columnas(usecols):
+    """Convierte 'C:M' en el rango (inicio, fin) de índices, ambos incluidos"""
+    if not usecols:
+        return None, None
+    try:
+        inicio, fin = usecols.strip().upper().split(':')
+    except ValueError:
+        return None, None
+    return columna_a_indice(inicio), columna_a_indice(fin)
+
+
+@functools.lru_cache(maxsize=256)
+def resolver_posiciones(columnas_plan, cabeceras):
+    """Resuelve, para las cabeceras de un archivo, la posición de cada campo del plan.
+
+    ``columnas_plan`` es una tupla de (campo, índice configurado, cabeceras alternativas)
+    y el resultado un diccionario campo -> tupla de posiciones por orden de prioridad.
+    Se cachea porque todos los bloques e importaciones de un tipo comparten cabeceras.
+    """
+    posiciones = {}
+    for campo, indice, alternativas in columnas_plan:
+        encontradas = []
+        if indice is not None and indice < len(cabeceras):
+            encontradas.append(indice)
+        for alternativa in alternativas:
+            if alternativa in cabeceras:
+                encontradas.append(cabeceras.index(alternativa))
+        posiciones[campo] = tuple(encontradas)
+    return posiciones
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Normalización de documentos de identidad españoles (DNI, NIE y NIF).
+
+La clave normalizada (sin prefijo de país ni separadores, en mayúsculas y con la
+letra de control) permite buscar partners por igualdad en lugar de por subcadena.
+"""
+
+import re
+
+LETRAS_DNI = 'TRWAGMYFPDXBNJZSQVHLCKE'
+PREFIJOS_NIE = {'X': '0', 'Y': '1', 'Z': '2'}
+
+PATRON_DNI = re.compile(r'^(\d{7,8})([A-Z]?)$')
+PATRON_NIE = re.compile(r'^([XYZ])(\d{7})([A-Z]?)$')
+
+
+def letra_dni(numero):
+    """Letra de control de un número de DNI (o de NIE con la letra inicial ya sustituida)"""
+    return LETRAS_DNI[int(numero) % 23]
+
+
+def normalizar_documento(texto):
+    """Clave normalizada del documento, o False si está vacío.
+
+    Los DNI de 7 cifras se completan con un cero a la izquierda y a los DNI y NIE
+    sin letra se les añade la de control; el resto de documentos (CIF, extranjeros)
+    se devuelven solo limpios.
+    """
+    documento = re.sub(r'[^0-9A-Z]', '', (texto or '').upper())
+    if documento.startswith('ES') and len(documento) > 9:
+        documento = documento[2:]
+    if not documento:
+        return False
+
+    match = PATRON_DNI.match(documento)
+    if match:
+        numero = match.group(1).zfill(8)
+        return numero + (match.group(2) or letra_dni(numero))
+
+    match = PATRON_NIE.match(documento)
+    if match:
+        letra = match.group(3) or letra_dni(PREFIJOS_NIE[match.group(1)] + match.group(2))
+        return match.group(1) + match.group(2) + letra
+
+    return documento
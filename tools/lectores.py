@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""Registro de lectores de extractos por formato.
+
+Cada lector recibe el contenido del archivo y el plan de extracción compilado
+del tipo de extracto, y genera DataFrames (el archivo completo o bloques de
+filas). El contenido puede ser ``bytes`` o un archivo proyectado en memoria
+(``mmap``) para no copiarlo. Si el plan incluye ``max_filas`` la lectura se
+detiene tras esas filas.
+Los motores (pandas, xlrd, openpyxl...) se importan la primera vez que se usan,
+para no cargarlos en todos los workers de Odoo.
+"""
+
+import importlib
+import io
+import itertools
+import logging
+import mmap
+import sys
+import zipfile
+
+from .columnas import resolver_posiciones
+
+_logger = logging.getLogger(__name__)
+
+LECTORES = {}
+_MOTORES = {}
+
+
+def registrar_lector(formato):
+    """Registra la función como lector del formato indicado"""
+    def decorador(funcion):
+        LECTORES[formato] = funcion
+        return funcion
+    return decorador
+
+
+def cargar_motor(nombre):
+    """Importa un motor de lectura la primera vez que se usa"""
+    modulo = _MOTORES.get(nombre)
+    if modulo is None:
+        modulo = _MOTORES[nombre] = importlib.import_module(nombre)
+    return modulo
+
+
+class ArchivoProyectado(mmap.mmap):
+    """Archivo proyectado en memoria que se puede pasar como objeto de archivo (zipfile exige ``seekable``)"""
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+
+def cerrar_proyeccion(data):
+    """Cierra un archivo proyectado sin ocultar el error de lectura que se esté propagando.
+
+    Si un lector ha fallado, sus búferes (referenciados desde la traza del error) aún
+    apuntan a la proyección y cerrarla lanza ``BufferError``; en ese caso se deja que
+    se libere al recoger esos búferes.
+    """
+    try:
+        data.close()
+    except BufferError:
+        _logger.debug("Proyección del archivo aún en uso por el lector; se liberará al recogerla")
+
+
+def flujo(data):
+    """Objeto de archivo de solo lectura sobre el contenido, sin copiarlo"""
+    if isinstance(data, (bytes, bytearray)):
+        return io.BytesIO(data)
+    data.seek(0)
+    return data
+
+
+def soporta(formato):
+    """Indica si hay un lector registrado para el formato"""
+    return formato in LECTORES
+
+
+def leer(data, plan):
+    """Genera los DataFrames del archivo según el formato del plan"""
+    return LECTORES[plan['formato']](data, plan)
+
+
+def hojas(data, formato):
+    """Nombres de las hojas del archivo (una sola para los formatos de texto)"""
+    if formato == 'xlsx':
+        openpyxl = cargar_motor('openpyxl')
+        book = openpyxl.load_workbook(flujo(data), read_only=True)
+        try:
+            return list(book.sheetnames)
+        finally:
+            book.close()
+    if formato == 'xls':
+        xlrd = cargar_motor('xlrd')
+        book = xlrd.open_workbook(file_contents=data, on_demand=True)
+        try:
+            return book.sheet_names()
+        finally:
+            book.release_resources()
+    return ['']
+
+
+def reparar_estilos_xlsx(data):
+    """Arregla estilos vacíos en archivos xlsx.
+
+    Solo se reescribe el archivo cuando xl/styles.xml contiene <fill/>; el resto de
+    miembros se copian con su ``ZipInfo`` (nombre, fecha y tipo de compresión).
+    """
+    try:
+        with zipfile.ZipFile(flujo(data), "r") as zin:
+            if "xl/styles.xml" not in zin.namelist():
+                return data
+            styles = zin.read("xl/styles.xml")
+            if b"<fill/>" not in styles:
+                return data
+
+            zout_buffer = io.BytesIO()
+            with zipfile.ZipFile(zout_buffer, "w") as zout:
+                for item in zin.infolist():
+                    if item.filename == "xl/styles.xml":
+                        zout.writestr(item, styles.replace(b"<fill/>", b""), compress_type=zipfile.ZIP_DEFLATED)
+                    else:
+                        zout.writestr(item, zin.read(item))
+            return zout_buffer.getvalue()
+    except Exception:
+        return data
+
+
+def leer_archivo(data, plan, todas_las_hojas=False):
+    """Lee y normaliza un archivo completo sin acceder a la base de datos.
+
+    Pensado para ejecutarse en un proceso aparte: ``data`` son los bytes del archivo y
+    ``plan`` un dict simple. Repara los estilos de los xlsx y, si se piden todas las
+    hojas, lee cada una. Devuelve una lista de (nombre de la hoja, bloques, perfil) con
+    el resultado de ``leer_normalizado`` de cada hoja.
+    """
+    if plan['formato'] == 'xlsx':
+        data = reparar_estilos_xlsx(data)
+    nombres = [False]
+    if todas_las_hojas and plan['formato'] in ('xls', 'xlsx'):
+        nombres = hojas(data, plan['formato'])
+    resultados = []
+    for indice, nombre in enumerate(nombres):
+        bloques, perfil = leer_normalizado(data, dict(plan, hoja=indice))
+        resultados.append((nombre, bloques, perfil))
+    return resultados
+
+
+def leer_normalizado(data, plan):
+    """Lee y normaliza un archivo (o la hoja ``plan['hoja']``) sin acceder a la base de datos.
+
+    Devuelve la lista de DataFrames normalizados y el perfil aprendido si el plan no
+    tenía o si se ha vuelto a aprender (igual que al importar, cuando los fallos
+    superan el umbral).
+    """
+    from . import normalizacion
+    bloques = []
+    perfil = None
+    for df in leer(data, plan):
+        if not plan['perfil']:
+            perfil = normalizacion.aprender_perfil(df, plan)
+            plan = dict(plan, perfil=perfil)
+        datos = normalizacion.normalizar(df, plan)
+        if datos.attrs['tasa_fallos'] > plan['umbral_reaprendizaje']:
+            # El formato del banco ha cambiado: las celdas ya se han interpretado con las reglas generales
+            perfil = normalizacion.aprender_perfil(df, plan)
+            plan = dict(plan, perfil=perfil)
+        bloques.append(datos)
+    return bloques, perfil
+
+
+def _read_params_csv(data, plan, sep=None):
+    """Parámetros de pandas.read_csv comunes a CSV y TXT"""
+    read_params = {
+        'filepath_or_buffer': flujo(data),
+        'skiprows': plan['skiprows'],
+        'keep_default_na': False,
+        'header': 0 if plan['first_row_headers'] else None,
+        'nrows': plan.get('max_filas'),
+        'encoding': plan['codificacion'] or None,
+    }
+    if sep:
+        read_params['sep'] = sep
+    return read_params
+
+
+@registrar_lector('xls')
+def leer_xls(data, plan):
+    """Lee una hoja de un xls, la primera salvo que el plan indique otra (por bloques si el plan lo indica).
+
+    Las dos lecturas recorren las mismas filas y columnas (``_filas_xls``) con la misma
+    cabecera. xlrd carga siempre el libro completo en memoria, así que en xls la lectura
+    por bloques solo acota el tamaño de los DataFrames, no el del archivo leído.
+    """
+    if plan['lectura_por_bloques']:
+        yield from agrupar_en_bloques(_filas_xls(data, plan), plan)
+        return
+    yield filas_a_dataframe(_filas_xls(data, plan), plan)
+
+
+@registrar_lector('xlsx')
+def leer_xlsx(data, plan):
+    """Lee una hoja de un xlsx, la primera salvo que el plan indique otra (por bloques si el plan lo indica)"""
+    if plan['lectura_por_bloques']:
+        yield from agrupar_en_bloques(_filas_xlsx(data, plan), plan)
+        return
+
+    pd = cargar_motor('pandas')
+    cargar_motor('openpyxl')
+    read_params = {
+        'io': flujo(data),
+        'engine': 'openpyxl',
+        'sheet_name': plan.get('hoja', 0),
+        'skiprows': plan['skiprows'],
+        'keep_default_na': False,
+        'header': 0 if plan['first_row_headers'] else None,
+        'nrows': plan.get('max_filas'),
+    }
+    if plan['inicio_columna'] is not None:
+        read_params['usecols'] = list(range(plan['inicio_columna'], plan['fin_columna'] + 1))
+    yield quitar_filas_vacias(pd.read_excel(**read_params))
+
+
+@registrar_lector('csv')
+def leer_csv(data, plan):
+    """Lee un archivo CSV (con el delimitador configurado o coma)"""
+    sep = plan['delimitador'] or ','
+    if plan['motor_csv'] == 'arrow':
+        yield _leer_arrow(data, plan, sep)
+        return
+    pd = cargar_motor('pandas')
+    yield pd.read_csv(**_read_params_csv(data, plan, sep=sep))
+
+
+@registrar_lector('txt')
+def leer_txt(data, plan):
+    """Lee un archivo TXT como CSV (con el delimitador configurado o tab)"""
+    sep = plan['delimitador'] or '\t'
+    if plan['motor_csv'] == 'arrow':
+        yield _leer_arrow(data, plan, sep)
+        return
+    pd = cargar_motor('pandas')
+    yield pd.read_csv(**_read_params_csv(data, plan, sep=sep))
+
+
+def _leer_arrow(data, plan, sep):
+    """Lee un CSV/TXT con el lector columnar multihilo de Arrow, solo con las columnas del plan.
+
+    Las columnas de texto se leen como texto y el resto con tipo (números y, si hay
+    perfil aprendido, fechas), de forma que llegan ya convertidas a la normalización.
+    Las posiciones de los campos en el DataFrame reducido se indican en ``attrs``.
+    """
+    pa = cargar_motor('pyarrow')
+    pacsv = cargar_motor('pyarrow.csv')
+    read_options = pacsv.ReadOptions(
+        use_threads=True,
+        skip_rows=plan['skiprows'],
+        autogenerate_column_names=not plan['first_row_headers'],
+        encoding=plan['codificacion'] or 'utf8',
+    )
+    parse_options = pacsv.ParseOptions(delimiter=sep)
+
+    # Las cabeceras se obtienen del primer bloque, sin leer el resto del archivo
+    with pacsv.open_csv(pa.BufferReader(data), read_options=read_options, parse_options=parse_options) as lector:
+        nombres = lector.schema.names
+    posiciones = resolver_posiciones(plan['columnas'], tuple(nombres))
+    necesarias = sorted({posicion for lista in posiciones.values() for posicion in lista})
+    unicas = len(set(nombres)) == len(nombres)
+
+    perfil = plan.get('perfil') or {}
+    timestamp_parsers = [pacsv.ISO8601]
+    if perfil.get('formato_fecha'):
+        timestamp_parsers.append(perfil['formato_fecha'])
+    convert_options = pacsv.ConvertOptions(
+        include_columns=[nombres[posicion] for posicion in necesarias] if unicas else None,
+        column_types={
+            nombres[posicion]: pa.string()
+            for campo in ('concepto', 'ordenante', 'observaciones')
+            for posicion in posiciones[campo]
+        },
+        timestamp_parsers=timestamp_parsers,
+        decimal_point=',' if perfil.get('separador_decimal') == 'coma' else '.',
+        strings_can_be_null=False,
+    )
+    if plan.get('max_filas'):
+        # Lectura por lotes con parada temprana
+        with pacsv.open_csv(
+            pa.BufferReader(data),
+            read_options=read_options,
+            parse_options=parse_options,
+            convert_options=convert_options,
+        ) as lector:
+            lotes = []
+            for lote in lector:
+                lotes.append(lote)
+                if sum(lote.num_rows for lote in lotes) >= plan['max_filas']:
+                    break
+            tabla = pa.Table.from_batches(lotes, schema=lector.schema).slice(0, plan['max_filas'])
+    else:
+        tabla = pacsv.read_csv(
+            pa.BufferReader(data),
+            read_options=read_options,
+            parse_options=parse_options,
+            convert_options=convert_options,
+        )
+    if not unicas:
+        tabla = tabla.select(necesarias)
+
+    df = tabla.to_pandas(date_as_object=False)
+    nuevas = {posicion: indice for indice, posicion in enumerate(necesarias)}
+    df.attrs['posiciones'] = {
+        campo: tuple(nuevas[posicion] for posicion in lista)
+        for campo, lista in posiciones.items()
+    }
+    return df
+
+
+def _filas_xlsx(data, plan):
+    """Recorre las filas de la hoja xlsx en modo solo lectura, sin cargar el libro completo"""
+    openpyxl = cargar_motor('openpyxl')
+    inicio, fin = plan['inicio_columna'], plan['fin_columna']
+    book = openpyxl.load_workbook(flujo(data), read_only=True, data_only=True)
+    try:
+        sheet = book.worksheets[plan.get('hoja', 0)]
+        # La etiqueta <dimension> de muchos extractos es incorrecta (p. ej. "A1"): se
+        # recorre la hoja completa, como hace pandas con openpyxl
+        sheet.reset_dimensions()
+        yield from sheet.iter_rows(
+            min_row=plan['skiprows'] + 1,
+            min_col=inicio + 1 if inicio is not None else None,
+            max_col=fin + 1 if fin is not None else None,
+            values_only=True,
+        )
+    finally:
+        book.close()
+
+
+def _filas_xls(data, plan):
+    """Recorre las filas de la hoja xls sin construir una lista intermedia.
+
+    xlrd lee el libro completo al abrirlo (``on_demand`` solo retrasa el resto de hojas).
+    """
+    xlrd = cargar_motor('xlrd')
+    inicio, fin = plan['inicio_columna'], plan['fin_columna']
+    book = xlrd.open_workbook(file_contents=data, on_demand=True)
+    try:
+        sheet = book.sheet_by_index(plan.get('hoja', 0))
+        for row_idx in range(plan['skiprows'], sheet.nrows):
+            yield sheet.row_values(row_idx, inicio or 0, fin + 1 if fin is not None else None)
+    finally:
+        book.release_resources()
+
+
+def _separar_cabecera(filas, plan):
+    """Devuelve el iterador de filas de datos (hasta ``max_filas``) y los nombres de columna.
+
+    Las filas son None si el archivo no tiene ni la cabecera.
+    """
+    filas = iter(filas)
+    if plan['first_row_headers']:
+        cabecera = next(filas, None)
+        if cabecera is None:
+            return None, None
+        columnas = [
+            valor if valor not in (None, '') else 'Unnamed: %s' % i
+            for i, valor in enumerate(cabecera)
+        ]
+    else:
+        columnas = None
+    if plan.get('max_filas'):
+        filas = itertools.islice(filas, plan['max_filas'])
+    return filas, columnas
+
+
+def _fila_vacia(fila):
+    """Indica si la fila no tiene ningún valor"""
+    return all(valor is None or valor == '' for valor in fila)
+
+
+def quitar_filas_vacias(df):
+    """Quita del DataFrame las filas sin ningún valor, como hace la lectura fila a fila"""
+    vacias = (df.isna() | df.eq('')).all(axis=1)
+    if not vacias.any():
+        return df
+    return df[~vacias].reset_index(drop=True)
+
+
+def filas_a_dataframe(filas, plan):
+    """Construye un único DataFrame con todas las filas, con la misma cabecera que por bloques"""
+    filas, columnas = _separar_cabecera(filas, plan)
+    if filas is None:
+        return cargar_motor('pandas').DataFrame()
+    return _bloque_a_dataframe([fila for fila in filas if not _fila_vacia(fila)], columnas)
+
+
+def agrupar_en_bloques(filas, plan):
+    """Agrupa las filas en DataFrames de tamaño fijo respetando el límite de memoria configurado"""
+    filas, columnas = _separar_cabecera(filas, plan)
+    if filas is None:
+        return
+
+    limite_memoria = max(plan['memoria_maxima_mb'], 1) * 1024 * 1024
+    tamano_bloque = max(plan['tamano_bloque'], 1)
+    bloque = []
+    for fila in filas:
+        if _fila_vacia(fila):
+            continue
+        if not bloque:
+            # Ajustar el tamaño del bloque al tamaño estimado de las filas
+            tamano_fila = sum(sys.getsizeof(valor) for valor in fila) + sys.getsizeof(fila)
+            filas_por_bloque = min(tamano_bloque, max(1, limite_memoria // max(tamano_fila, 1)))
+        bloque.append(fila)
+        if len(bloque) >= filas_por_bloque:
+            yield _bloque_a_dataframe(bloque, columnas)
+            bloque = []
+    if bloque:
+        yield _bloque_a_dataframe(bloque, columnas)
+
+
+def _bloque_a_dataframe(bloque, columnas):
+    """Construye el DataFrame de un bloque de filas"""
+    pd = cargar_motor('pandas')
+    if columnas is None:
+        return pd.DataFrame.from_records(bloque)
+    num_columnas = len(columnas)
+    return pd.DataFrame.from_records(
+        [tuple(fila[:num_columnas]) + (None,) * (num_columnas - len(fila)) for fila in bloque],
+        columns=columnas
+    )
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""Normalización por columnas de los extractos leídos con pandas.
+
+Las columnas configuradas en el tipo de extracto se resuelven una sola vez y
+los importes, fechas y textos se limpian como vectores completos.
+"""
+
+from datetime import date
+import numbers
+
+import pandas as pd
+
+from .columnas import resolver_posiciones
+
+FORMATOS_FECHA = ['%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%Y/%m/%d', '%d/%m/%y']
+
+# Filas de muestra usadas para aprender el perfil de formato de un tipo de extracto
+FILAS_MUESTRA = 200
+
+SEPARADORES = {'punto': '.', 'coma': ',', 'ninguno': ''}
+
+
+def posiciones_columnas(df, plan):
+    """Posiciones de cada campo del plan en el DataFrame.
+
+    Los lectores que ya seleccionan las columnas necesarias indican sus posiciones
+    en ``attrs['posiciones']``; si no, se resuelven con las cabeceras.
+    """
+    return df.attrs.get('posiciones') or resolver_posiciones(plan['columnas'], tuple(df.columns))
+
+
+def _vacios(serie):
+    """Máscara de celdas sin valor (nulas o texto en blanco)"""
+    if pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie):
+        return serie.isna() | serie.astype(str).str.strip().eq('')
+    return serie.isna()
+
+
+def extraer_columna(df, posiciones):
+    """Devuelve la primera columna con valor de entre las posiciones dadas, celda a celda"""
+    if len(posiciones) == 1:
+        # Una sola columna: se conserva su tipo (números y fechas ya convertidos por el lector)
+        return df.iloc[:, posiciones[0]]
+    resultado = pd.Series(None, index=df.index, dtype=object)
+    for posicion in posiciones:
+        serie = df.iloc[:, posicion]
+        resultado = resultado.where(~_vacios(resultado), serie.astype(object))
+    return resultado
+
+
+def limpiar_importes(serie):
+    """Convierte una columna de importes a float (NaN si no se puede interpretar)"""
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype(float)
+    texto = serie.astype(str).str.replace(r'[€$\s]', '', regex=True)
+    # El separador decimal es el último que aparece; el otro se considera de miles
+    coma_decimal = texto.str.rfind(',') > texto.str.rfind('.')
+    texto = texto.where(
+        ~coma_decimal,
+        texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    )
+    texto = texto.where(coma_decimal, texto.str.replace(',', '', regex=False))
+    return pd.to_numeric(texto, errors='coerce')
+
+
+def _serial_excel(numeros):
+    """Convierte números de serie de fecha de Excel a fechas"""
+    return pd.to_datetime(numeros - 25569, unit='D', errors='coerce')
+
+
+def convertir_fechas(serie, hoy=None):
+    """Convierte una columna de fechas (texto, fecha o número de serie Excel) a objetos date"""
+    hoy = hoy or date.today()
+    fechas = _interpretar_fechas(serie)
+    return fechas.dt.date.where(fechas.notna(), hoy)
+
+
+def _interpretar_fechas(serie):
+    """Convierte una columna de fechas con las reglas generales (NaT si no se puede interpretar)"""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        fechas = serie
+    elif pd.api.types.is_numeric_dtype(serie):
+        fechas = _serial_excel(serie)
+    else:
+        es_texto = serie.map(lambda valor: isinstance(valor, str))
+        es_numero = serie.map(lambda valor: isinstance(valor, (int, float)) and not isinstance(valor, bool))
+        fechas = pd.to_datetime(serie.where(~es_texto & ~es_numero), errors='coerce')
+        numeros = pd.to_numeric(serie.where(es_numero), errors='coerce')
+        fechas = fechas.fillna(_serial_excel(numeros))
+        texto = serie.where(es_texto).str.strip()
+        for formato in FORMATOS_FECHA:
+            pendientes = fechas.isna() & es_texto
+            if not pendientes.any():
+                break
+            fechas = fechas.fillna(pd.to_datetime(texto.where(pendientes), format=formato, errors='coerce'))
+    return fechas
+
+
+def limpiar_textos(serie):
+    """Convierte una columna a texto, con cadena vacía para las celdas sin valor"""
+    return serie.where(~_vacios(serie), '').astype(str)
+
+
+def _celdas_numericas(serie):
+    """Máscara de celdas que ya son números (no texto) en una columna de tipo object"""
+    return serie.map(lambda valor: isinstance(valor, numbers.Number) and not isinstance(valor, bool)).astype(bool)
+
+
+def importes_con_perfil(serie, perfil):
+    """Convierte una columna de importes con los separadores y el signo aprendidos.
+
+    Las reglas del perfil solo se aplican a las celdas de texto; las que ya son
+    números se conservan tal cual.
+    """
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype(float)
+    numericas = _celdas_numericas(serie)
+    texto = serie.astype(str).str.replace(r'[€$\s]', '', regex=True)
+    if perfil['signo'] == 'sufijo':
+        negativos = texto.str.endswith('-')
+        texto = texto.str.rstrip('-')
+    elif perfil['signo'] == 'parentesis':
+        negativos = texto.str.startswith('(') & texto.str.endswith(')')
+        texto = texto.str.strip('()')
+    else:
+        negativos = pd.Series(False, index=serie.index)
+    miles = SEPARADORES[perfil['separador_miles']]
+    if miles:
+        texto = texto.str.replace(miles, '', regex=False)
+    if perfil['separador_decimal'] == 'coma':
+        texto = texto.str.replace(',', '.', regex=False)
+    importes = pd.to_numeric(texto, errors='coerce')
+    importes = importes.where(~negativos, -importes.abs())
+    return importes.where(~numericas, pd.to_numeric(serie.where(numericas), errors='coerce'))
+
+
+def fechas_con_perfil(serie, perfil):
+    """Convierte una columna de fechas con el formato aprendido, sin probar formatos fila a fila"""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    if perfil['fecha_serial']:
+        return _serial_excel(pd.to_numeric(serie, errors='coerce'))
+    if perfil['formato_fecha']:
+        return pd.to_datetime(serie.astype(str).str.strip(), format=perfil['formato_fecha'], errors='coerce')
+    return pd.to_datetime(serie, errors='coerce')
+
+
+def aprender_perfil(df, plan):
+    """Aprende el formato de fechas e importes a partir de las primeras filas del DataFrame"""
+    muestra = df.head(FILAS_MUESTRA)
+    posiciones = posiciones_columnas(muestra, plan)
+    fechas = extraer_columna(muestra, posiciones['fecha'])
+    fechas = fechas[~_vacios(fechas)]
+    importes = extraer_columna(muestra, posiciones['importe'])
+    importes = importes[~_vacios(importes)]
+
+    perfil = {
+        'formato_fecha': False,
+        'fecha_serial': False,
+        'separador_decimal': 'punto',
+        'separador_miles': 'ninguno',
+        'signo': 'prefijo',
+    }
+
+    # Fechas: serie de Excel, formato de texto con más aciertos o fechas nativas
+    es_texto = fechas.map(lambda valor: isinstance(valor, str))
+    es_numero = fechas.map(lambda valor: isinstance(valor, (int, float)) and not isinstance(valor, bool))
+    if len(fechas) and es_numero.sum() * 2 > len(fechas):
+        perfil['fecha_serial'] = True
+    elif es_texto.any():
+        textos = fechas[es_texto].astype(str).str.strip()
+        aciertos = {
+            formato: pd.to_datetime(textos, format=formato, errors='coerce').notna().sum()
+            for formato in FORMATOS_FECHA
+        }
+        mejor = max(FORMATOS_FECHA, key=lambda formato: aciertos[formato])
+        if aciertos[mejor]:
+            perfil['formato_fecha'] = mejor
+
+    # Importes: separador decimal, de miles y convención de signo
+    textos = importes[importes.map(lambda valor: isinstance(valor, str))].astype(str)
+    textos = textos.str.replace(r'[€$\s]', '', regex=True)
+    if len(textos):
+        if textos.str.endswith('-').any():
+            perfil['signo'] = 'sufijo'
+        elif (textos.str.startswith('(') & textos.str.endswith(')')).any():
+            perfil['signo'] = 'parentesis'
+        votos_coma = textos.str.contains(r',\d{1,2}\)?-?$').sum()
+        votos_punto = textos.str.contains(r'\.\d{1,2}\)?-?$').sum()
+        if votos_coma > votos_punto:
+            perfil['separador_decimal'] = 'coma'
+            if textos.str.contains('.', regex=False).any():
+                perfil['separador_miles'] = 'punto'
+        elif textos.str.contains(',', regex=False).any():
+            perfil['separador_miles'] = 'coma'
+    return perfil
+
+
+def filtrar_desde(df, plan, fecha_minima):
+    """Descarta las filas con fecha anterior a ``fecha_minima`` interpretando solo la columna de fechas"""
+    posiciones = posiciones_columnas(df, plan)
+    columna_fechas = extraer_columna(df, posiciones['fecha'])
+    perfil = plan.get('perfil')
+    if perfil:
+        fechas = fechas_con_perfil(columna_fechas, perfil)
+        fallos = fechas.isna()
+        if fallos.any():
+            # Como al normalizar: reglas generales y, sin fecha, la de hoy
+            fechas = fechas.fillna(pd.to_datetime(convertir_fechas(columna_fechas.where(fallos))))
+    else:
+        fechas = pd.to_datetime(convertir_fechas(columna_fechas))
+    anteriores = fechas.lt(pd.Timestamp(fecha_minima))
+    return df[~anteriores.to_numpy()]
+
+
+def normalizar(df, plan):
+    """Devuelve un DataFrame con las columnas fecha, importe, concepto y observaciones.
+
+    ``plan`` es el plan de extracción compilado del tipo de extracto. Si incluye un
+    perfil aprendido, fechas e importes se convierten con él en una sola pasada y
+    solo las celdas que no encajan se interpretan con las reglas generales; la
+    proporción de esas celdas queda en ``attrs['tasa_fallos']``. Si incluye una
+    ``fecha_minima``, las filas anteriores se descartan antes de normalizar y su
+    número queda en ``attrs['filas_omitidas']``. La columna ``fecha_leida`` indica
+    las filas cuya fecha se ha podido interpretar (el resto llevan la de hoy).
+    """
+    filas_omitidas = 0
+    if plan.get('fecha_minima'):
+        filas = len(df)
+        df = filtrar_desde(df, plan, plan['fecha_minima'])
+        filas_omitidas = filas - len(df)
+    posiciones = posiciones_columnas(df, plan)
+    columna_importes = extraer_columna(df, posiciones['importe'])
+    columna_fechas = extraer_columna(df, posiciones['fecha'])
+    perfil = plan.get('perfil')
+    if perfil:
+        con_valor = ~_vacios(columna_importes), ~_vacios(columna_fechas)
+        importes = importes_con_perfil(columna_importes, perfil)
+        fechas = fechas_con_perfil(columna_fechas, perfil)
+        fallos_importe = con_valor[0] & importes.isna()
+        fallos_fecha = con_valor[1] & fechas.isna()
+        total = int(con_valor[0].sum() + con_valor[1].sum())
+        tasa_fallos = (fallos_importe.sum() + fallos_fecha.sum()) / total if total else 0.0
+        if fallos_importe.any():
+            importes = importes.where(~fallos_importe, limpiar_importes(columna_importes.where(fallos_importe)))
+        if fallos_fecha.any():
+            fechas = fechas.fillna(_interpretar_fechas(columna_fechas.where(fallos_fecha)))
+    else:
+        tasa_fallos = 0.0
+        importes = limpiar_importes(columna_importes)
+        fechas = _interpretar_fechas(columna_fechas)
+    # Las filas sin fecha interpretable se importan con la de hoy
+    fechas_leidas = fechas.notna()
+    fechas = fechas.dt.date.where(fechas_leidas, date.today())
+    conceptos = limpiar_textos(extraer_columna(df, posiciones['concepto']))
+
+    observaciones = limpiar_textos(extraer_columna(df, posiciones['observaciones']))
+    ordenantes = limpiar_textos(extraer_columna(df, posiciones['ordenante']))
+    con_ordenante = ordenantes.ne('')
+    observaciones = observaciones.where(
+        ~con_ordenante,
+        (observaciones + ' | Ordenante: ' + ordenantes).where(
+            observaciones.ne(''), 'Ordenante: ' + ordenantes
+        )
+    )
+
+    datos = pd.DataFrame({
+        'fecha': fechas,
+        'importe': importes,
+        'concepto': conceptos,
+        'observaciones': observaciones,
+        'fecha_leida': fechas_leidas,
+    }, index=df.index)
+    datos.attrs['tasa_fallos'] = float(tasa_fallos)
+    datos.attrs['filas_omitidas'] = filas_omitidas
+    return datos
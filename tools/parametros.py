@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""Lectura de los parámetros del sistema (ir.config_parameter) del módulo."""
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def entero(ICP, clave, defecto, minimo=0):
+    """Valor entero del parámetro ``clave``, o ``defecto`` si falta, no es un número o es menor que ``minimo``"""
+    valor = ICP.get_param(clave, defecto)
+    try:
+        numero = int(str(valor).strip())
+    except (TypeError, ValueError):
+        _logger.warning("El parámetro %s tiene un valor no numérico (%r); se usa %s", clave, valor, defecto)
+        return defecto
+    if numero < minimo:
+        _logger.warning("El parámetro %s vale %s, menos del mínimo %s; se usa %s", clave, numero, minimo, defecto)
+        return defecto
+    return numero
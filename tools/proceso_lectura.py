@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Lectura de archivos en los procesos de la importación por lotes.
+
+Los procesos se crean con ``spawn`` y no deben importar Odoo ni el módulo ``extractos``
+(su ``__init__`` carga los modelos) solo para leer: el paquete ``tools``, que no
+depende de Odoo, se carga por su ruta con el nombre ``PAQUETE_LECTURA`` tanto en el
+worker como en cada proceso, y las tareas se envían como funciones de ese paquete. El
+pool ejecuta este archivo por su ruta (``runpy.run_path``) con ``NOMBRE_ARRANQUE``
+como nombre para cargarlo antes de recibir la primera tarea.
+
+Los procesos reciben la ruta del archivo en el filestore, no su contenido, y la
+proyectan en memoria como ``extractos.extracto._abrir_archivo``.
+"""
+
+import contextlib
+import importlib
+import importlib.util
+import mmap
+import os
+import sys
+
+NOMBRE_ARRANQUE = '__extractos_proceso_lectura__'
+PAQUETE_LECTURA = 'extractos_lectura'
+
+
+def cargar_paquete():
+    """Carga (una sola vez) ``tools`` como ``PAQUETE_LECTURA`` y devuelve su ``proceso_lectura``"""
+    if PAQUETE_LECTURA not in sys.modules:
+        ruta = os.path.dirname(os.path.abspath(__file__))
+        spec = importlib.util.spec_from_file_location(
+            PAQUETE_LECTURA, os.path.join(ruta, '__init__.py'), submodule_search_locations=[ruta],
+        )
+        paquete = importlib.util.module_from_spec(spec)
+        sys.modules[PAQUETE_LECTURA] = paquete
+        try:
+            spec.loader.exec_module(paquete)
+        except BaseException:
+            del sys.modules[PAQUETE_LECTURA]
+            raise
+    return importlib.import_module(PAQUETE_LECTURA + '.proceso_lectura')
+
+
+@contextlib.contextmanager
+def abrir(origen):
+    """Contenido de ``origen``: la ruta de un archivo, proyectado en memoria y de solo lectura, o los bytes"""
+    from . import lectores
+    if not isinstance(origen, str):
+        yield origen
+        return
+    with open(origen, 'rb') as archivo:
+        if not os.fstat(archivo.fileno()).st_size:
+            # mmap no admite archivos vacíos
+            yield b''
+            return
+        data = lectores.ArchivoProyectado(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield data
+        finally:
+            lectores.cerrar_proyeccion(data)
+
+
+def leer_origen(origen, plan, todas_las_hojas=False):
+    """``lectores.leer_archivo`` sobre la ruta o los bytes de ``origen``"""
+    from . import lectores
+    with abrir(origen) as data:
+        return lectores.leer_archivo(data, plan, todas_las_hojas)
+
+
+if __name__ == NOMBRE_ARRANQUE:
+    cargar_paquete()
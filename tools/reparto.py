@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Reparto en cascada del importe de un pago entre sus filas de distribución.
+
+Trabaja con valores simples, sin ORM, para poder calcular el reparto completo
+en memoria y guardarlo después con el mínimo de escrituras.
+"""
+
+
+def calcular_reparto(importe, filas, aplicar_moras=True, aplicar_penalizaciones=True, pago_parcial=False):
+    """Reparte ``importe`` entre las filas, en el orden dado.
+
+    ``filas`` es una lista de diccionarios con importe, enabled y concepto (nombre).
+    Devuelve la lista de (importe_pagado, pagado_parcial) de cada fila, el indicador
+    de pago parcial de la línea (``pago_parcial`` si ninguna fila llega a pagarse)
+    y el importe distribuido.
+    """
+    pagos = []
+    importe_distribuido = 0
+
+    for fila in filas:
+        if importe < 0.01:
+            pagos.append((0, False))
+            continue
+        if fila['enabled'] == False:
+            pagos.append((0, False))
+            continue
+        if aplicar_moras == False and fila['concepto'] == 'Mora':
+            pagos.append((0, False))
+            continue
+        if aplicar_penalizaciones == False and fila['concepto'] == 'Penalización':
+            pagos.append((0, False))
+            continue
+
+        diff = round(fila['importe'], 2) - round(importe, 2)
+        if diff > 0.01:
+            # Pago parcial
+            pagos.append((importe, True))
+            importe_distribuido += importe
+            importe = 0
+            pago_parcial = True
+        elif diff < 0.01:
+            # Pago completo y sobra
+            pagos.append((fila['importe'], False))
+            importe_distribuido += fila['importe']
+            pago_parcial = False
+            importe -= fila['importe']
+        else:
+            # Pago completo exacto
+            pagos.append((fila['importe'], False))
+            importe_distribuido += fila['importe']
+            pago_parcial = False
+            importe = 0
+
+    return pagos, pago_parcial, importe_distribuido
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+
+from . import importacion_lote
+from . import previsualizacion
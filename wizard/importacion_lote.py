@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+import logging
+import multiprocessing
+import os
+import runpy
+from concurrent.futures import ProcessPoolExecutor
+
+from ..tools import lectores, parametros, proceso_lectura
+
+_logger = logging.getLogger(__name__)
+
+
+class ExtractosImportacionLote(models.TransientModel):
+    _name = 'extractos.importacion_lote'
+    _description = 'Importación de Extractos por Lotes'
+
+    fecha = fields.Date(string='Fecha', required=True, default=fields.Date.today)
+    archivo_ids = fields.One2many('extractos.importacion_lote.archivo', 'lote_id', string='Archivos')
+    todas_las_hojas = fields.Boolean(
+        string='Importar Todas las Hojas',
+        default=False,
+        help='En archivos XLS/XLSX crea un extracto por cada hoja del libro; si no, solo se lee la primera'
+    )
+
+    def action_importar(self):
+        """Lee los archivos en paralelo y crea sus extractos en una única pasada ordenada.
+
+        Los archivos de tipos que se importan en segundo plano, o todos si el lote es
+        grande, no se leen aquí: se crean sus extractos y se dejan en cola.
+        """
+        self.ensure_one()
+        tareas = self._preparar_tareas()
+        if not tareas:
+            raise UserError(_('No se ha seleccionado ningún archivo.'))
+
+        ICP = self.env['ir.config_parameter'].sudo()
+        lote_grande = len(tareas) > parametros.entero(ICP, 'extractos.lote_en_segundo_plano', 10)
+        en_cola, en_linea = [], []
+        for tarea in tareas:
+            if lote_grande or tarea['cartera'].tipo_extracto_id.importacion_en_segundo_plano:
+                en_cola.append(tarea)
+            else:
+                en_linea.append(tarea)
+
+        extractos = self.env['extractos.extracto']
+        encolados = self.env['extractos.extracto']
+        errores = []
+        importados = self.env['ir.attachment']
+        for tarea in en_cola:
+            attachment = tarea['attachment']
+            try:
+                with self.env.cr.savepoint():
+                    encolados |= self._crear_extractos_en_cola(tarea)
+                importados |= attachment
+            except Exception as e:
+                _logger.error("Error al poner en cola %s: %s", attachment.name, str(e), exc_info=True)
+                errores.append('%s: %s' % (attachment.name, str(e)))
+        if encolados:
+            encolados._poner_en_cola()
+
+        resultados = self._leer_en_paralelo([(self._origen(tarea['attachment']), tarea['plan']) for tarea in en_linea])
+        for tarea, (leidas, error) in zip(en_linea, resultados):
+            attachment = tarea['attachment']
+            if error:
+                errores.append('%s: %s' % (attachment.name, error))
+                continue
+            completo = True
+            for indice, (hoja, bloques, perfil) in enumerate(leidas):
+                nombre = attachment.name
+                if len(leidas) > 1:
+                    nombre = '%s - %s' % (attachment.name, hoja)
+                try:
+                    with self.env.cr.savepoint():
+                        tipo_extracto = tarea['cartera'].tipo_extracto_id
+                        if perfil:
+                            # Aprendido o reaprendido al leer, con el mismo umbral que la importación
+                            tipo_extracto._guardar_perfil(perfil)
+                        extracto = self.env['extractos.extracto'].create({
+                            'name': nombre,
+                            'fecha': self.fecha,
+                            'cartera_id': tarea['cartera'].id,
+                            'file': attachment.datas,
+                            'file_name': attachment.name,
+                            'hoja': indice,
+                        })
+                        extracto._importar_bloques(bloques)
+                        extractos |= extracto
+                except Exception as e:
+                    _logger.error("Error al importar %s: %s", nombre, str(e), exc_info=True)
+                    errores.append('%s: %s' % (nombre, str(e)))
+                    completo = False
+            if completo:
+                importados |= attachment
+
+        # Los archivos con errores se conservan para poder reintentarlos
+        importados.unlink()
+
+        action = {
+            'name': _('Extractos importados'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'extractos.extracto',
+            'view_mode': 'tree,form',
+            'domain': [('id', 'in', (extractos | encolados).ids)],
+        }
+        if errores or encolados:
+            titulo = _('Se importaron %s extractos') % len(extractos)
+            if encolados:
+                titulo = _('Se importaron %s extractos y %s quedan en cola') % (len(extractos), len(encolados))
+            mensajes = errores
+            if encolados:
+                mensajes = [_('Los extractos en cola se importarán en segundo plano.')] + errores
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': titulo,
+                    'message': '\n'.join(mensajes),
+                    'type': 'warning' if errores else 'info',
+                    'sticky': bool(errores),
+                    'next': action,
+                }
+            }
+        return action
+
+    def _preparar_tareas(self):
+        """Una tarea de lectura por archivo, con el plan como dict simple"""
+        tareas = []
+        for archivo in self.archivo_ids:
+            tipo_extracto = archivo.cartera_id.tipo_extracto_id
+            if not lectores.soporta(tipo_extracto.formato):
+                raise UserError(_('Formato %s no soportado aún.') % tipo_extracto.formato)
+            plan = tipo_extracto._plan_extraccion()
+            plan = dict(
+                plan,
+                perfil=dict(plan['perfil']) if plan['perfil'] else None,
+                fecha_minima=archivo.cartera_id._fecha_minima_importacion(),
+            )
+            for attachment in archivo.attachment_ids:
+                tareas.append({
+                    'cartera': archivo.cartera_id,
+                    'attachment': attachment,
+                    'plan': plan,
+                })
+        return tareas
+
+    def _crear_extractos_en_cola(self, tarea):
+        """Crea sin leerlos los extractos del archivo, uno por hoja si se piden todas"""
+        attachment = tarea['attachment']
+        hojas = [False]
+        formato = tarea['plan']['formato']
+        if self.todas_las_hojas and formato in ('xls', 'xlsx'):
+            with proceso_lectura.abrir(self._origen(attachment)) as data:
+                if formato == 'xlsx':
+                    data = lectores.reparar_estilos_xlsx(data)
+                hojas = lectores.hojas(data, formato)
+        return self.env['extractos.extracto'].create([{
+            'name': '%s - %s' % (attachment.name, hoja) if len(hojas) > 1 else attachment.name,
+            'fecha': self.fecha,
+            'cartera_id': tarea['cartera'].id,
+            'file': attachment.datas,
+            'file_name': attachment.name,
+            'hoja': indice,
+        } for indice, hoja in enumerate(hojas)])
+
+    def _origen(self, attachment):
+        """Ruta del adjunto en el filestore o, si está guardado en la base de datos, su contenido"""
+        if attachment.store_fname:
+            ruta = attachment._full_path(attachment.store_fname)
+            if os.path.isfile(ruta):
+                return ruta
+            _logger.warning("No se encuentra el archivo %s del filestore", attachment.store_fname)
+        return attachment.raw or b''
+
+    def _leer_en_paralelo(self, tareas):
+        """Lee y normaliza cada (origen, plan) en un pool de procesos.
+
+        Los procesos se arrancan con ``spawn`` (un fork del worker de Odoo copiaría el
+        cursor abierto, los bloqueos del registro y sus hilos) y solo reciben la ruta
+        del archivo en el filestore (ver ``_origen``) y dicts: no acceden a la base de
+        datos ni importan Odoo, solo el paquete ``tools`` (ver ``tools/proceso_lectura.py``).
+        Cada proceso carga pandas, así que el pool es pequeño
+        (``extractos.procesos_lectura``) y los lotes grandes se importan en segundo plano.
+        Devuelve, en el mismo orden, tuplas (hojas leídas, error), con las hojas como
+        las devuelve ``lectores.leer_archivo``.
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        procesos = min(parametros.entero(ICP, 'extractos.procesos_lectura', 2, minimo=1), len(tareas))
+
+        resultados = []
+        if procesos <= 1:
+            for origen, plan in tareas:
+                try:
+                    resultados.append((proceso_lectura.leer_origen(origen, plan, self.todas_las_hojas), False))
+                except Exception as e:
+                    resultados.append((None, str(e)))
+            return resultados
+
+        with ProcessPoolExecutor(
+            max_workers=procesos,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=runpy.run_path,
+            initargs=(proceso_lectura.__file__, None, proceso_lectura.NOMBRE_ARRANQUE),
+        ) as executor:
+            # Misma función cargada fuera del módulo, para que los procesos no lo importen
+            leer_origen = proceso_lectura.cargar_paquete().leer_origen
+            futuros = [
+                executor.submit(leer_origen, origen, plan, self.todas_las_hojas)
+                for origen, plan in tareas
+            ]
+            for futuro in futuros:
+                try:
+                    resultados.append((futuro.result(), False))
+                except Exception as e:
+                    resultados.append((None, str(e)))
+        return resultados
+
+
+class ExtractosImportacionLoteArchivo(models.TransientModel):
+    _name = 'extractos.importacion_lote.archivo'
+    _description = 'Archivos de una Cartera en la Importación por Lotes'
+
+    lote_id = fields.Many2one('extractos.importacion_lote', string='Lote', required=True, ondelete='cascade')
+    cartera_id = fields.Many2one(
+        'extractos.cartera',
+        string='Cartera',
+        required=True,
+        help='Cartera a la que pertenecen los extractos de estos archivos'
+    )
+    attachment_ids = fields.Many2many(
+        'ir.attachment',
+        'extractos_importacion_lote_archivo_attachment_rel',
+        'archivo_id',
+        'attachment_id',
+        string='Archivos'
+    )
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _, _lt
+from odoo.exceptions import UserError
+from markupsafe import Markup
+import logging
+
+from ..tools import lectores
+
+_logger = logging.getLogger(__name__)
+
+ESTADOS_PREVISTOS = {
+    'pending': _lt('Pendiente'),
+    'discarded': _lt('Descartada'),
+    'duplicate': _lt('Duplicada'),
+}
+
+
+class ExtractosPrevisualizacion(models.TransientModel):
+    _name = 'extractos.previsualizacion'
+    _description = 'Previsualización de la Importación de un Extracto'
+
+    extracto_id = fields.Many2one('extractos.extracto', string='Extracto', required=True, ondelete='cascade')
+    num_filas = fields.Integer(
+        string='Filas a Previsualizar',
+        default=50,
+        help='Solo se leen estas primeras filas del archivo'
+    )
+    resultado = fields.Html(string='Resultado', compute='_compute_resultado', sanitize=False)
+
+    @api.depends('extracto_id', 'num_filas')
+    def _compute_resultado(self):
+        for wizard in self:
+            if not wizard.extracto_id or wizard.num_filas <= 0:
+                wizard.resultado = False
+                continue
+            # Los errores se muestran en el resultado: un compute no debe lanzar excepciones
+            try:
+                wizard.resultado = wizard._renderizar(*wizard._simular_importacion())
+            except UserError as e:
+                wizard.resultado = wizard._renderizar_error(e.args[0])
+            except Exception as e:
+                _logger.error("Error al previsualizar el extracto: %s", str(e), exc_info=True)
+                wizard.resultado = wizard._renderizar_error(_('Error al leer el archivo: %s', str(e)))
+
+    def _simular_importacion(self):
+        """Lee y normaliza las primeras filas y predice el resultado de importarlas, sin escribir nada"""
+        from ..tools import normalizacion  # Carga pandas solo al previsualizar
+        extracto = self.extracto_id
+        tipo_extracto = extracto.cartera_id.tipo_extracto_id
+        if not extracto.file:
+            raise UserError(_('No se ha seleccionado ningún archivo.'))
+        if not tipo_extracto:
+            raise UserError(_('Debe seleccionar una cartera con tipo de extracto configurado.'))
+        if not lectores.soporta(tipo_extracto.formato):
+            raise UserError(_('Formato %s no soportado aún.', tipo_extracto.formato))
+
+        # El mismo plan que la importación, solo limitado en filas: mismo lector y columnas
+        plan = dict(tipo_extracto._plan_extraccion(), hoja=extracto.hoja, max_filas=self.num_filas)
+
+        # La misma marca de agua que la importación: las filas anteriores y las ya importadas se omiten
+        cartera = extracto.cartera_id
+        fecha_minima = cartera._fecha_minima_importacion()
+        huellas_marca_agua = cartera._huellas_marca_agua() if fecha_minima else set()
+
+        filas = []
+        omitidas = 0
+        ocurrencias = {}
+        with extracto._abrir_archivo() as data:
+            if tipo_extracto.formato in ['xlsx']:
+                data = extracto._fix_xlsx_empty_styles(data)
+            for df in lectores.leer(data, plan):
+                if not plan['perfil']:
+                    # El perfil aprendido aquí no se guarda en el tipo de extracto
+                    plan = dict(plan, perfil=normalizacion.aprender_perfil(df, plan))
+                datos = normalizacion.normalizar(df, dict(plan, fecha_minima=fecha_minima))
+                omitidas += datos.attrs.get('filas_omitidas', 0)
+                for fila in extracto._preparar_lineas(datos, ocurrencias):
+                    if fila['huella'] in huellas_marca_agua:
+                        omitidas += 1
+                    else:
+                        filas.append(fila)
+
+        huellas_existentes = extracto._huellas_existentes([fila['huella'] for fila in filas])
+        pendientes = []
+        for fila in filas:
+            if fila['huella'] in huellas_existentes:
+                fila['state'] = 'duplicate'
+            elif fila['state'] == 'pending':
+                pendientes.append(fila)
+
+        prestamo_ids = self.env['extractos.extracto_linea']._buscar_prestamos(extracto.cartera_id, [
+            {'id': False, 'observaciones': fila['observaciones'], 'importe': fila['importe']}
+            for fila in pendientes
+        ])
+        prestamos = self.env['linx.prestamo'].browse(list({p_id for p_id in prestamo_ids if p_id}))
+        nombres = {prestamo.id: prestamo.display_name for prestamo in prestamos}
+        for fila, prestamo_id in zip(pendientes, prestamo_ids):
+            fila['prestamo'] = nombres.get(prestamo_id, '')
+        return filas, omitidas
+
+    def _renderizar(self, filas, omitidas):
+        """Tabla HTML con las filas simuladas y el número de filas omitidas por la marca de agua"""
+        cabecera = Markup('').join(
+            Markup('<th>%s</th>') % titulo
+            for titulo in [_('Fecha'), _('Importe'), _('Concepto'), _('Observaciones'), _('Estado'), _('Préstamo')]
+        )
+        cuerpo = Markup('').join(
+            Markup('<tr class="%s"><td>%s</td><td class="text-end">%.2f</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>') % (
+                'text-muted' if fila['state'] != 'pending' else '',
+                fila['fecha'] or '',
+                fila['importe'],
+                fila['concepto'],
+                fila['observaciones'],
+                str(ESTADOS_PREVISTOS[fila['state']]),
+                fila.get('prestamo', ''),
+            )
+            for fila in filas
+        )
+        resumen = _('%s filas: %s pendientes, %s descartadas, %s duplicadas, %s con préstamo previsto.') % (
+            len(filas),
+            len([fila for fila in filas if fila['state'] == 'pending']),
+            len([fila for fila in filas if fila['state'] == 'discarded']),
+            len([fila for fila in filas if fila['state'] == 'duplicate']),
+            len([fila for fila in filas if fila.get('prestamo')]),
+        )
+        if omitidas:
+            resumen += ' ' + _('%s filas omitidas por ser anteriores a la última fecha importada en la cartera.') % omitidas
+        return Markup('<p>%s</p><table class="table table-sm table-striped"><thead><tr>%s</tr></thead><tbody>%s</tbody></table>') % (
+            resumen, cabecera, cuerpo
+        )
+
+    def _renderizar_error(self, mensaje):
+        """Aviso HTML con el error de la previsualización"""
+        return Markup('<div class="alert alert-danger" role="alert">%s</div>') % mensaje